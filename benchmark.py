@@ -0,0 +1,222 @@
+"""
+Benchmarks of the hot paths of the game and the AI.
+
+Run this file to time each benchmark on a fixed corpus of board positions and print the
+results as JSON, which can be saved and compared between versions to catch regressions.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+from game import TetrominoGame, PIECE_CELLS, clone_game, get_filled, place_piece, undo_game
+from eval import GameTree
+from search import SearchContext, get_placements
+from features import numpy
+
+SEED = 111  # seeds the queues, the placements and the garbage holes of the corpus
+WEIGHTS = [0.4, 0.9, 0.3, 0.5, 0.8, 0.2, 0.6, 0.3, 0.4, 0.5, 0.7, 0.9]
+SEARCHES = [(2, 5), (3, 3), (3, 5), (4, 3)]  # the (max_height, best_n) of each tree searched
+
+
+def seven_bag_queue(rng: random.Random, length: int) -> List[str]:
+    """Return a queue of at least length pieces from shuffled 7-bags"""
+    queue = []
+    while len(queue) < length:
+        bag = ['s', 'z', 't', 'o', 'i', 'j', 'l']
+        rng.shuffle(bag)
+        queue.extend(bag)
+    return queue
+
+
+def board_corpus(count: int, seed: Optional[int] = SEED) -> List[TetrominoGame]:
+    """Return count games without colours, each played for a different number of moves from
+    seed. Most moves are the best placement by raw score and the rest are random, and some
+    garbage is received, so the boards are varied but not topped out.
+
+    Preconditions:
+        - count >= 1
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    corpus = []
+    while len(corpus) < count:
+        game = TetrominoGame(seven_bag_queue(rng, 200), colours=False)
+        for _ in range(0, rng.randint(3, 30)):
+            if rng.random() < 0.1:
+                game.pending_garbage.append(rng.randint(1, 3))
+            tree = GameTree(None, ())
+            tree.expand(game, SearchContext(2, 1, WEIGHTS))
+            if tree.subtrees == [] or game.game_over:
+                break
+            if rng.random() < 0.75:
+                move = max(tree.subtrees, key=lambda s: s.raw_score)
+            else:
+                move = rng.choice(tree.subtrees)
+            place_piece(game, move.inputs)
+        if not game.game_over:
+            game.history.clear()
+            corpus.append(game)
+    return corpus
+
+
+def measure(setup: Callable[[], list], operate: Callable[[list], None],
+            repeat: int) -> Dict[str, float]:
+    """Time operate on the items made by setup repeat times. Only operate is timed. Return the
+    best and median seconds per item, the number of items and the number of repeats.
+
+    Preconditions:
+        - repeat >= 1
+        - setup() != []
+    """
+    times = []
+    count = 0
+    for _ in range(0, repeat):
+        items = setup()
+        count = len(items)
+        start = perf_counter()
+        operate(items)
+        times.append((perf_counter() - start) / count)
+    return {'best': min(times), 'median': median(times), 'items': count, 'repeat': repeat}
+
+
+def clones(corpus: List[TetrominoGame], size: int,
+           prepare: Optional[Callable[[TetrominoGame], None]] = None) -> List[TetrominoGame]:
+    """Return size clones of the games of corpus in turn, each prepared with prepare"""
+    games = []
+    for i in range(0, size):
+        game = clone_game(corpus[i % len(corpus)])
+        if prepare is not None:
+            prepare(game)
+        games.append(game)
+    return games
+
+
+def against_wall(game: TetrominoGame) -> None:
+    """Drop the current piece onto the stack and push it against the left wall, where
+    rotating it needs kicks
+    """
+    game.soft_drop()
+    game.das_left()
+
+
+def lock_placements(corpus: List[TetrominoGame]) -> Tuple[list, list]:
+    """Return the (game, inputs) of the placements of the current piece from each game of
+    corpus that clear lines, and of those that do not
+    """
+    clearing = []
+    other = []
+    for game in corpus:
+        for inputs in get_placements(game):
+            if place_piece(game, inputs)[1] != []:
+                clearing.append((game, inputs))
+            else:
+                other.append((game, inputs))
+            undo_game(game)
+    return (clearing, other)
+
+
+def ready_to_lock(placements: list, size: int) -> List[TetrominoGame]:
+    """Return size clones of the games of placements in turn, with the piece of each moved to
+    where its inputs lock it
+    """
+    games = []
+    for i in range(0, size):
+        game, inputs = placements[i % len(placements)]
+        game = clone_game(game)
+        game.do_inputs(inputs)
+        game.soft_drop()
+        games.append(game)
+    return games
+
+
+def run_benchmarks(repeat: Optional[int] = 5, size: Optional[int] = 500,
+                   corpus_size: Optional[int] = 24) -> dict:
+    """Run every benchmark and return the results with what they were run on. Each engine
+    benchmark operates on size games from a corpus of corpus_size positions.
+
+    Preconditions:
+        - repeat >= 1
+        - size >= 1
+        - corpus_size >= 1
+    """
+    corpus = board_corpus(corpus_size)
+    results = {}
+
+    cells = [(piece, [y, x], orientation) for piece in PIECE_CELLS for orientation in range(4)
+             for y in range(0, 40) for x in range(0, 10)]
+    results['get_filled'] = measure(lambda: cells, lambda items: [get_filled(*c) for c in items],
+                                    repeat)
+
+    for name in ['move_left', 'move_right', 'move_down', 'rotate_cw', 'rotate_ccw']:
+        results[name] = measure(lambda: clones(corpus, size),
+                                lambda games, n=name: [getattr(g, n)() for g in games], repeat)
+    for name in ['rotate_cw', 'rotate_ccw']:
+        results[name + '_kicked'] = measure(lambda: clones(corpus, size, against_wall),
+                                            lambda games, n=name: [getattr(g, n)() for g in games],
+                                            repeat)
+
+    clearing, other = lock_placements(corpus)
+    results['lock_piece'] = measure(lambda: ready_to_lock(other, size),
+                                    lambda games: [g.lock_piece() for g in games], repeat)
+    if clearing != []:
+        results['lock_piece_clear'] = measure(lambda: ready_to_lock(clearing, size),
+                                              lambda games: [g.lock_piece() for g in games],
+                                              repeat)
+
+    random.seed(SEED)
+    results['accept_pending'] = measure(lambda: clones(corpus, size),
+                                        lambda games: [g.accept_pending(2) for g in games],
+                                        repeat)
+
+    search = SearchContext(2, 1, WEIGHTS)
+
+    def children() -> list:
+        """Return an unevaluated subtree for each placement from each game of corpus"""
+        return [(GameTree(None, inputs, current=2), game) for game in corpus
+                for inputs in get_placements(game)]
+    results['evaluate_score'] = measure(children, lambda items: [s.evaluate_score(g, search)
+                                                                 for s, g in items], repeat)
+
+    for max_height, best_n in SEARCHES:
+        results[f'generate_subtrees_{max_height}_{best_n}'] = measure(
+            lambda h=max_height, n=best_n: [GameTree(g, (), SearchContext(h, n, WEIGHTS))
+                                            for g in corpus[:4]],
+            lambda trees: [t.generate_subtrees() for t in trees], max(1, repeat // 2))
+        if numpy is not None:
+            # the same search scoring the placements from each tree at once
+            results[f'generate_subtrees_batch_{max_height}_{best_n}'] = measure(
+                lambda h=max_height, n=best_n: [GameTree(g, (), SearchContext(h, n, WEIGHTS,
+                                                                              batch=True))
+                                                for g in corpus[:4]],
+                lambda trees: [t.generate_subtrees() for t in trees], max(1, repeat // 2))
+
+    return {'python': platform.python_version(), 'implementation':
+            platform.python_implementation(), 'machine': platform.machine(),
+            'numpy': numpy is not None, 'seed': SEED, 'corpus': corpus_size,
+            'unit': 'seconds per item', 'results': results}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the benchmarks with the options in argv and print or save the results as JSON"""
+    parser = argparse.ArgumentParser(description='Time the hot paths of the game and the AI.')
+    parser.add_argument('--repeat', type=int, default=5, help='times to run each benchmark')
+    parser.add_argument('--size', type=int, default=500, help='games per engine benchmark')
+    parser.add_argument('--corpus', type=int, default=24, help='positions in the corpus')
+    parser.add_argument('--output', help='file to write the JSON to instead of printing it')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.repeat, args.size, args.corpus)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,16 @@ File for evaluating board positions and using a tree-based AI to play the game
 """
 from __future__ import annotations
 from typing import List, Tuple, Optional
-from copy import deepcopy
-from game import TetrominoGame, get_filled
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from heapq import nlargest
+from multiprocessing import Event, synchronize
+from time import perf_counter
+from game import TetrominoGame, clone_game, pack_game, place_piece_at, random_since_save, \
+    restore_game, save_game, snapshot_game, state_hash, undo_game
+from search import SearchBudget, SearchContext, SearchStats, EvaluationCache, \
+    TranspositionTable, expand_pool, find_placements, ponder_packed, search_packed, \
+    set_ponder_signal
+from features import batch_features, get_features, numpy, score_batch
 
 
 class TetrominoAI:
@@ -16,213 +24,799 @@ class TetrominoAI:
         - max_height: limits the maximum height of the tree
         - best_n: limits the number of subtrees to recurse on to the best n subtrees
         - weights: the weights for the heuristics used to evaluate the piece placements
+        - table: the scores of searched states shared by every tree the AI makes, None if
+        table_size was 0
+        - cache: the features of evaluated boards shared by every tree the AI makes, None if
+        cache_size was 0
+        - beam_width: the number of placements kept at each level of the tree when searching
+        with a beam, 0 to search keeping the best_n subtrees of every subtree instead
+        - time_budget: the seconds each move may be searched for, 0 for no limit
+        - node_budget: the number of placements each move may evaluate, 0 for no limit
+        - workers: the number of processes searching each move, 0 to search in this process
+        - pool: the processes searching each move, or the process pondering between moves,
+        started on the first move searched or pondered with them and kept until close is called.
+        None if not started
+        - ponder: the number of levels past max_height the tree may be searched to in the
+        background between moves, 0 to not search between moves
+        - searched_height: the height the tree is searched to in full
+        - ponder_signal: the event that stops the pondering in the pool, None if not started
+        - ponder_future: the result of the pondering since the last move, None if there is none
+        - move_stats: the statistics of the search of each move in order, None if not kept
+        - batch: whether the placements from each tree are scored all at once with numpy
+
+    With ponder, the tree of the game expected after each move keeps being searched deeper in
+    the process of the pool until the next move is searched, so that it does not hold up this
+    process. The deeper tree then replaces the tree of the move. If the expected game arrives,
+    the move's own search is skipped once the pondering reached max_height, and the move is
+    picked from the deepest height it finished. If garbage arrives instead, the deeper tree is
+    rebased or adopted like any other, so only the placements the garbage changed are searched
+    again. The beam and workers do not ponder.
+
+    With workers, the subtrees of the root are each searched in a process of the pool, or the
+    beam is split between them at each level. Budgets are not used with workers.
+
+    With a time_budget or a node_budget, each move is searched deeper and deeper until the
+    budget is spent or max_height is reached, and the move is picked from the deepest search
+    that finished.
 
     Representation Invariants:
         - self.max_height >= 2
         - self.best_n >= 1
+        - self.beam_width >= 0
+        - self.time_budget >= 0
+        - self.node_budget >= 0
+        - self.workers >= 0
+        - self.ponder >= 0
     """
     game: TetrominoGame
     tree: GameTree
     max_height: int
     best_n: int
     weights: list
+    table: Optional[TranspositionTable]
+    cache: Optional[EvaluationCache]
+    beam_width: int
+    time_budget: float
+    node_budget: int
+    workers: int
+    pool: Optional[Executor]
+    ponder: int
+    searched_height: int
+    ponder_signal: Optional[synchronize.Event]
+    ponder_future: Optional[Future]
+    move_stats: Optional[List[SearchStats]]
+    batch: bool
 
     def __init__(self, game: TetrominoGame, max_height: int, best_n: int,
-                 weights: List[float]) -> None:
-        """Initialize a new TetrominoAI instance"""
+                 weights: List[float], table_size: Optional[int] = 100000,
+                 beam_width: Optional[int] = 0, time_budget: Optional[float] = 0,
+                 node_budget: Optional[int] = 0, workers: Optional[int] = 0,
+                 ponder: Optional[int] = 0, cache_size: Optional[int] = 0,
+                 stats: Optional[bool] = False, batch: Optional[bool] = False) -> None:
+        """Initialize a new TetrominoAI instance. table_size is the most states whose scores
+        are remembered between moves and cache_size the most boards whose features are, 0 to
+        not remember any. stats is whether to keep the statistics of each search.
+
+        batch is off by default since scoring the placements with numpy has not measured
+        faster than scoring them one at a time, see benchmark.py.
+
+        The cache is only looked in after the table misses, so it rarely helps while the table
+        is on and is off by default.
+        """
         self.game = game
         self.max_height = max_height
         self.best_n = best_n
         self.weights = weights
-        self.tree = GameTree(self.game, [], self.max_height, self.best_n, self.weights)
+        self.beam_width = beam_width
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        self.workers = workers
+        self.pool = None
+        self.ponder = ponder
+        self.searched_height = 1
+        self.ponder_signal = None
+        self.ponder_future = None
+        self.batch = batch
+        if stats:
+            self.move_stats = []
+        else:
+            self.move_stats = None
+        if table_size > 0:
+            self.table = TranspositionTable(table_size)
+        else:
+            self.table = None
+        if cache_size > 0:
+            self.cache = EvaluationCache(cache_size)
+        else:
+            self.cache = None
+        self.tree = GameTree(self.game, (), SearchContext(self.max_height, self.best_n,
+                                                          self.weights, self.table, self.cache,
+                                                          batch=batch))
 
     def generate_tree(self) -> None:
         """Generate the subtrees of the tree and calculate the score of the subtrees"""
-        # make new tree if received garbage
-        if self.game.board != self.tree.game_state.board:
-            self.tree = GameTree(self.game, [], self.max_height, self.best_n, self.weights)
+        pondered = self.stop_pondering()
+        if pondered is not None:
+            # the deeper tree of the pondering replaces the one it was started with, and is
+            # rebased or adopted below like it if the game is not the one expected
+            self.searched_height, self.tree.subtrees = pondered
+        stats = None
+        if self.move_stats is not None:
+            stats = SearchStats()
+            self.tree.search.stats = stats
+        start = perf_counter()
+
+        # make new tree if received garbage or the game is otherwise not the one expected,
+        # keeping the subtrees of placements that still lead to the same state
+        if state_hash(self.game) != state_hash(self.tree.game_state) \
+                or self.game.pending_garbage != self.tree.game_state.pending_garbage:
+            shift = garbage_shift(self.tree.game_state, self.game)
+            if shift is not None:
+                # only the garbage changed, so the same placements are scored again instead
+                self.tree.game_state = clone_game(self.game)
+                self.tree.rebase(self.tree.game_state, shift)
+            else:
+                old = self.tree
+                self.tree = GameTree(self.game, (), SearchContext(
+                    self.max_height, self.best_n, self.weights, self.table, self.cache, stats,
+                    self.batch))
+                self.tree.adopt(old, self.beam_width == 0)
+            self.searched_height = 1
+
+        if self.workers > 0:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers)
+            if self.beam_width > 0:
+                self.tree.generate_beam(self.beam_width, pool=self.pool, chunks=self.workers)
+            else:
+                self.tree.generate_parallel(self.pool)
+        elif self.time_budget > 0 or self.node_budget > 0:
+            self.generate_anytime()
+        elif self.beam_width > 0:
+            self.tree.generate_beam(self.beam_width)
+        else:
+            if self.searched_height < self.max_height:
+                self.tree.generate_subtrees()
+                self.searched_height = self.max_height
+            # a tree pondered deeper than max_height is scored as deep as it was searched
+            self.tree.search.max_height = self.searched_height
+            self.tree.get_sub_score()
+            self.tree.search.max_height = self.max_height
+
+        if stats is not None:
+            stats.moves = 1
+            stats.total = perf_counter() - start
+            self.move_stats.append(stats)
+            # searching in the background is not counted
+            self.tree.search.stats = None
+
+    def generate_anytime(self) -> None:
+        """Search the tree one level deeper at a time until the budget of the move is spent or
+        max_height is reached. The sub_scores of the subtrees of the root are left as they were
+        after the deepest search that finished. The first level is always searched in full.
+        """
+        budget = SearchBudget(self.time_budget or None, self.node_budget or None)
+        if self.beam_width > 0:
+            self.tree.generate_beam(self.beam_width, budget)
+            return
+
+        scores = None
+        # the levels already searched in full only need their scores backed up
+        height = max(2, min(self.searched_height, self.max_height))
+        while height <= self.max_height:
+            self.tree.search.max_height = height
+            if scores is None:
+                self.tree.generate_subtrees()
+            else:
+                self.tree.generate_subtrees(budget=budget)
+                if budget.spent():
+                    break
+            self.tree.get_sub_score()
+            scores = [s.sub_score for s in self.tree.subtrees]
+            height += 1
+
+        # an unfinished search only went deeper in some subtrees, so it is not used
+        for s, score in zip(self.tree.subtrees, scores):
+            s.sub_score = score
+        self.searched_height = height - 1
+
+    def start_pondering(self) -> None:
+        """Start searching the expected game deeper in the process of the pool"""
+        if self.pool is None:
+            self.ponder_signal = Event()
+            self.pool = ProcessPoolExecutor(1, initializer=set_ponder_signal,
+                                            initargs=(self.ponder_signal,))
+        self.ponder_signal.clear()
+        # the budget of the move may search as deep as max_height itself
+        limit = self.max_height
+        if self.time_budget == 0 and self.node_budget == 0:
+            limit += self.ponder
+        lowest = max(2, self.searched_height + 1)
+        # the tree is searched further from the levels it already has. Without a table, so that
+        # no state is left unsearched for a score only the table of the pool has
+        root = GameTree(None, (), SearchContext(lowest, self.best_n, self.weights,
+                                                batch=self.batch), self.tree.current)
+        root.raw_score = self.tree.raw_score
+        root.subtrees = self.tree.subtrees
+        self.ponder_future = self.pool.submit(ponder_packed, root,
+                                              pack_game(self.tree.game_state, limit),
+                                              lowest, limit)
+
+    def stop_pondering(self) -> Optional[Tuple[int, List[GameTree]]]:
+        """Stop the pondering, if any, wait for it to finish and return its result, see
+        ponder_packed. Return None if there was no pondering.
+        """
+        if self.ponder_future is None:
+            return None
+        self.ponder_signal.set()
+        pondered = self.ponder_future.result()
+        self.ponder_future = None
+        return pondered
+
+    def match_stats(self) -> SearchStats:
+        """Return the statistics of the search of every move so far added together
 
-        self.tree.generate_subtrees()
-        self.tree.get_sub_score()
+        Preconditions:
+            - self.move_stats is not None
+        """
+        total = SearchStats()
+        for stats in self.move_stats:
+            total.add(stats)
+        return total
+
+    def close(self) -> None:
+        """Stop pondering and shut down the processes of the pool, if any. A later move starts a
+        new pool.
+        """
+        self.stop_pondering()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
 
     def make_move(self) -> None:
-        """Make a move based on the maximum sub_score of the subtrees"""
-        moves = {s.sub_score: s for s in self.tree.subtrees}
-        self.tree = moves[max(moves)]
-        # iterate through the list of inputs and make the inputs in the list
-        for i in self.tree.inputs:
-            if i == 'cw':
-                self.game.rotate_cw()
-            elif i == 'ccw':
-                self.game.rotate_ccw()
-            elif i == 'left':
-                self.game.move_left()
-            elif i == 'right':
-                self.game.move_right()
-            elif i == 'hold':
-                self.game.hold_piece()
+        """Make a move based on the maximum sub_score of the subtrees. Of moves with equal
+        sub_score the first subtree is chosen, which is the one with the best raw_score.
+        """
+        state = self.tree.game_state
+        search = self.tree.search
+        self.tree = max(self.tree.subtrees, key=lambda s: s.sub_score)
+        # make the inputs in the list
+        self.game.do_inputs(self.tree.inputs)
         self.game.hard_drop()
 
+        # the chosen subtree becomes the root, so it keeps the expected game after its move
+        self.tree.place(state)
+        if random_since_save(state):
+            # the garbage received may have its holes elsewhere than when the tree was searched
+            self.tree.forget_placed()
+        state.history.clear()
+        self.tree.game_state = state
+        self.tree.search = search
+
         # reduce the current value to reflect the changed tree structure
         self.tree.reduce_current()
+        self.searched_height = max(self.searched_height - 1, 1)
+
+        if self.ponder > 0 and self.workers == 0 and self.beam_width == 0:
+            self.start_pondering()
 
 
 class GameTree:
     """The game tree will evaluate the board and determine the best piece placements given
     the board, the queue, and evaluation heuristics.
 
+    The whole tree is searched on the one game kept by the root. Each subtree is reached by
+    placing its piece on that game, straight where it locks once that is known, and is left by
+    undoing it again. In the same way only the root keeps the search, which its methods pass
+    down to the subtrees. Only generate_subtrees, rebase and get_sub_score, which are started on
+    the root, fall back on the tree's own search when none is given.
+
     Instance Attributes:
-        - game_state: the TetrominoGame that the tree is evaluating
+        - game_state: the TetrominoGame that the tree is evaluating, only kept by the root.
+        None for every other subtree
+        - search: the settings, table, cache and statistics of the search, only kept by the
+        root. None for every other subtree
         - raw_score: the score calculated from the evaluation algorithm
         - sub_score: the score of the tree taking into account the score of its subtrees
-        - inputs: the list of inputs that the tree will evaluate the score of
+        - inputs: the inputs that the tree will evaluate the score of
         - current: the current position in the full tree
-        - max_height: limits the maximum height of the tree
-        - best_n: limits the number of subtrees to recurse on to the best n subtrees
-        - weights: the weights for the heuristics used to evaluate the piece placements
+        - key: the state reached by the inputs with the attack, the kind of clear and the
+        pending garbage of the placement, None until evaluated. Placements with the same key
+        score the same and have the same subtrees
+        - placed: the row, column and orientation the piece of the inputs locks at and whether
+        it locks right after a rotation, on the game the inputs were found for. None until
+        known, and whether it locks after a rotation is None once the game may have changed
+
+    A tree searched less deep than before keeps its deeper subtrees, so that they can be used
+    again. Subtrees with current past the max_height of the search are left out of the search
+    and the scores.
 
     Representation Invariants:
-        - self.max_height >= 2
-        - self.best_n >= 1
-        - 1 <= self.current <= self.max_height
+        - self.current >= 1
+        - all(s.current == self.current + 1 for s in self.subtrees)
     """
-    game_state: TetrominoGame
+    # a tree can hold many thousands of subtrees, so they are kept without a __dict__
+    __slots__ = ('game_state', 'search', 'raw_score', 'sub_score', 'inputs', 'current',
+                 'subtrees', 'key', 'placed')
+    game_state: Optional[TetrominoGame]
+    search: Optional[SearchContext]
     raw_score: float
     sub_score: float
-    inputs: list[str]
+    inputs: Tuple[str, ...]
     current: int
-    max_height: int
-    best_n: int
     subtrees: list[GameTree]
-    weights: list[float]
-
-    def __init__(self, game: TetrominoGame, inputs: List[str], max_height: int,
-                 best_n: int, weights: List[float], current: Optional[int] = 1) -> None:
-        """Initialize a new GameTree"""
-        # use same queue (not mutated) in all subtrees to speed up tree generation
-        self.game_state = TetrominoGame(game.queue)
-
-        # use deepcopy to prevent aliasing when copying the TetrominoGame
-        self.game_state.queue_position = deepcopy(game.queue_position)
-        self.game_state.board = deepcopy(game.board)
-        self.game_state.current_combo = deepcopy(game.current_combo)
-        self.game_state.back_to_back = deepcopy(game.back_to_back)
-        self.game_state.hold = deepcopy(game.hold)
-        self.game_state.held = deepcopy(game.held)
-        self.game_state.held_index = deepcopy(game.held_index)
-        self.game_state.prev_held = deepcopy(game.prev_held)
-        self.game_state.pending_garbage = deepcopy(game.pending_garbage)
-        self.game_state.previous_action = deepcopy(game.previous_action)
+    key: Optional[tuple]
+    placed: Optional[Tuple[int, int, int, Optional[bool]]]
+
+    def __init__(self, game: Optional[TetrominoGame], inputs: Tuple[str, ...],
+                 search: Optional[SearchContext] = None, current: Optional[int] = 1) -> None:
+        """Initialize a new GameTree. Only the root is given a game and a search."""
+        # copy only the mutable state, the queue is shared and the colour layer is dropped
+        if game is not None:
+            self.game_state = clone_game(game)
+        else:
+            self.game_state = None
 
+        self.search = search
         self.inputs = inputs
         self.subtrees = []
         self.current = current
-        self.max_height = max_height
         self.raw_score = 0
-        self.best_n = best_n
-        self.weights = weights
+        self.key = None
+        self.placed = None
+
+    def generate_subtrees(self, game: Optional[TetrominoGame] = None,
+                          budget: Optional[SearchBudget] = None,
+                          search: Optional[SearchContext] = None) -> None:
+        """Generate subtrees based on possible placements. game is the game at this tree,
+        which is the root's game_state if not given. game is left unchanged.
+
+        Once the budget is spent no more subtrees are generated, leaving the search unfinished.
+        """
+        if game is None:
+            game = self.game_state
+        if search is None:
+            search = self.search
+        if budget is not None and budget.spent():
+            return
 
-    def generate_subtrees(self) -> None:
-        """Generate subtrees based on possible placements"""
         # generate new subtrees only if there aren't any
         if self.subtrees == []:
-            # generate possible placements using possible inputs (no soft drop yet)
-            piece = self.game_state.queue[self.game_state.queue_position]
-            possible = get_basic_placements(piece)
-
-            # generate possibilities with holding
-            held = self.game_state.held
-            possible_hold = []
-            if held != '' and self.game_state.hold is False:
-                possible_hold = get_basic_placements(held)
-                for placement in possible_hold:
-                    placement.insert(0, 'hold')
-                possible.extend(possible_hold)
-            if held == '':
-                possible_hold = get_basic_placements(
-                    self.game_state.queue[self.game_state.queue_position + 1])
-                for placement in possible_hold:
-                    placement.insert(0, 'hold')
+            self.expand(game, search, budget)
+            self.prune(search)
 
-            # create and evaluate subtrees using possible inputs
-            for sub in possible:
-                self.subtrees.append(GameTree(self.game_state, sub, self.max_height, self.best_n,
-                                              self.weights, self.current + 1))
-            for sub in possible_hold:
-                self.subtrees.append(GameTree(self.game_state, sub, self.max_height, self.best_n,
-                                              self.weights, self.current + 1))
+        # generate subtrees of the subtrees up until a certain maximum height
+        if self.current + 1 < search.max_height:
             for s in self.subtrees:
-                s.evaluate_score()
-
-            # prune the subtrees to the best n subtrees
-            n = min([self.best_n, len(self.subtrees)])
-            max_n_index = list(range(0, n))
-            max_n_score = [self.subtrees[j].raw_score for j in range(0, n)]
-            for k in range(n, len(self.subtrees)):
-                if self.subtrees[k].raw_score > min(max_n_score):
-                    index = max_n_score.index(min(max_n_score))
-                    max_n_index.pop(index)
-                    max_n_score.pop(index)
-                    max_n_index.append(k)
-                    max_n_score.append(self.subtrees[k].raw_score)
-            self.subtrees = [self.subtrees[i] for i in max_n_index]
+                # a state already searched as deep elsewhere keeps the score found there
+                if s.subtrees == [] and s.lookup_sub_score(search):
+                    continue
+                s.place(game)
+                s.generate_subtrees(game, budget, search)
+                undo_game(game)
+                if budget is not None and budget.spent():
+                    # the score of an unfinished subtree is not stored
+                    return
+                # back up the score now so that later transpositions in this tree can use it
+                if search.table is not None:
+                    s.get_sub_score(search)
+
+    def generate_parallel(self, pool: Executor) -> None:
+        """Generate the subtrees of the root like generate_subtrees, then search each of them in
+        a process of pool, and calculate the score of the subtrees like get_sub_score. Only the
+        scores come back, so the subtrees of the root are left without subtrees.
 
-        # generate subtrees of the subtrees up until a certain maximum height
-        if self.current + 1 < self.max_height:
+        Preconditions:
+            - self.game_state is not None
+        """
+        game = self.game_state
+        search = self.search
+        if self.subtrees == []:
+            self.expand(game, search)
+            self.prune(search)
+
+        if self.current + 1 < search.max_height:
+            futures = []
             for s in self.subtrees:
-                s.generate_subtrees()
+                # the subtree is searched again from scratch as the root of the process
+                root = GameTree(None, (), SearchContext(search.max_height, search.best_n,
+                                                        search.weights, batch=search.batch),
+                                s.current)
+                root.raw_score = s.raw_score
+                s.place(game)
+                futures.append(pool.submit(search_packed, root,
+                                           pack_game(game, search.max_height)))
+                undo_game(game)
+            for s, future in zip(self.subtrees, futures):
+                s.sub_score = future.result()
+        else:
+            for s in self.subtrees:
+                s.sub_score = s.raw_score
 
-    def evaluate_score(self) -> None:
-        """Calculate the score based on the weights"""
-        # move and lock the piece
-        self.move()
-        lock = self.game_state.lock_piece()
-        current = get_filled(self.game_state.queue[self.game_state.queue_position],
-                             self.game_state.piece_position, self.game_state.piece_orientation)
+        if self.subtrees == []:
+            self.sub_score = self.raw_score
+        else:
+            self.sub_score = (self.raw_score + max(s.sub_score for s in self.subtrees)) / 2
+
+    def adopt(self, old: GameTree, best_only: bool) -> None:
+        """Generate the subtrees of the root, only the best n if best_only, then give each the
+        subtrees of the subtree of old, an earlier root at the same queue position, that has
+        the same key. Placements whose state was not changed by new garbage keep their search
+        that way. Placements with the same inputs as a subtree of old whose state only differs
+        by garbage get its subtrees rebased instead.
+
+        Preconditions:
+            - self.game_state is not None
+            - old.game_state is not None
+        """
+        game = self.game_state
+        self.expand(game, self.search)
+        if best_only:
+            self.prune(self.search)
+        old_keys = {s.key: s for s in old.subtrees if s.key is not None}
+        old_inputs = {s.inputs: s for s in old.subtrees}
+        for s in self.subtrees:
+            if s.key in old_keys:
+                s.subtrees = old_keys[s.key].subtrees
+            elif s.inputs in old_inputs and old_inputs[s.inputs].subtrees != []:
+                o = old_inputs[s.inputs]
+                o.place(old.game_state)
+                s.place(game)
+                shift = garbage_shift(old.game_state, game)
+                if shift is not None:
+                    s.subtrees = o.subtrees
+                    s.rebase(game, shift, self.search)
+                undo_game(game)
+                undo_game(old.game_state)
+
+    def rebase(self, game: TetrominoGame, shift: int,
+               search: Optional[SearchContext] = None) -> None:
+        """Score the subtrees again for game, the game at this tree, which is the game they were
+        searched for with shift more rows of garbage or with the holes of its garbage moved.
+        game is left unchanged.
+
+        Only the raw scores are evaluated again, so no placements are generated. If any
+        placement now locks somewhere else than shift rows higher or with another attack or
+        kind of clear, all of the subtrees are removed to be generated again.
+        """
+        if search is None:
+            search = self.search
+        for s in self.subtrees:
+            placed, key = s.placed, s.key
+            # the placement may lock somewhere else on game, so it is found again
+            s.placed = None
+            s.raw_score = 0
+            s.evaluate_score(game, search)
+            if placed is None or s.placed[:3] != (placed[0] + shift, placed[1], placed[2]) \
+                    or s.key[1:3] != key[1:3]:
+                self.subtrees = []
+                return
 
-        surface = self.get_surface(current)
-        well = find_well(surface)
+        for s in self.subtrees:
+            if s.subtrees != []:
+                s.place(game)
+                s.rebase(game, shift, search)
+                undo_game(game)
+
+    def prune(self, search: SearchContext) -> None:
+        """Prune the subtrees to the best n subtrees by raw_score, best first. A subtree with
+        the same key as an earlier one reaches the same state, so it is dropped. Of subtrees
+        with equal raw_score the earlier ones are kept first.
+        """
+        start = perf_counter() if search.stats is not None else 0.0
+        count = len(self.subtrees)
+        # placements locking into the same cells with the same hold reach the same state
+        keys = set()
+        distinct = []
+        for s in self.subtrees:
+            if s.key is None:
+                distinct.append(s)
+            elif s.key not in keys:
+                keys.add(s.key)
+                distinct.append(s)
+        # nlargest keeps equal scores in their order
+        self.subtrees = nlargest(search.best_n, distinct, key=lambda s: s.raw_score)
+        if search.stats is not None:
+            search.stats.pruned += count - len(self.subtrees)
+            search.stats.selection += perf_counter() - start
+
+    def expand(self, game: TetrominoGame, search: SearchContext,
+               budget: Optional[SearchBudget] = None) -> None:
+        """Create and evaluate a subtree for every placement from game, the game at this tree,
+        if there are no subtrees yet. game is left unchanged. The evaluated placements are
+        taken from the node budget.
+        """
+        if self.subtrees == []:
+            stats = search.stats
+            start = perf_counter() if stats is not None else 0.0
+            # generate every distinct placement of the current piece and, with holding, of the
+            # piece that would replace it
+            possible = find_placements(game)
+            if budget is not None and budget.nodes is not None:
+                budget.nodes -= len(possible)
+
+            # create and evaluate subtrees using possible inputs
+            for sub, placed in possible:
+                subtree = GameTree(None, sub, current=self.current + 1)
+                subtree.placed = placed
+                self.subtrees.append(subtree)
+            generated = 0.0
+            simulated = 0.0
+            if stats is not None:
+                generated = perf_counter()
+                stats.generated += len(possible)
+                stats.depth = max(stats.depth, self.current)
+                stats.simulation += generated - start
+                simulated = stats.simulation
+
+            if search.batch and numpy is not None:
+                self.evaluate_subtrees(game, search)
+            else:
+                for s in self.subtrees:
+                    s.evaluate_score(game, search)
+
+            if stats is not None:
+                # the time lock spent placing the subtrees was added to simulation
+                stats.evaluation += perf_counter() - generated - (stats.simulation - simulated)
+
+    def evaluate_subtrees(self, game: TetrominoGame, search: SearchContext) -> None:
+        """Calculate the score of every subtree like evaluate_score, extracting the features
+        of all the boards not in the cache at once with batch_features. game is the game at
+        this tree and is left unchanged.
+
+        Preconditions:
+            - search.batch
+            - numpy is not None
+        """
+        # the subtrees whose boards are not in the cache with their cache keys, and the heights,
+        # holes, attack, kind of clear and combo after each of their placements
+        batch = []
+        keys = []
+        boards = []
+        for s in self.subtrees:
+            lock = s.lock(game, search)
+            entry = None
+            if search.table is not None:
+                entry = search.table.get(s.key)
+            if entry is not None:
+                s.raw_score = entry[0]
+                undo_game(game)
+                continue
+            if search.stats is not None:
+                search.stats.evaluated += 1
+
+            key = (game.board_hash, lock[0], lock[2], game.current_combo)
+            features = None
+            if search.cache is not None:
+                features = search.cache.get(key)
+            if features is not None:
+                s.score_features(features, search)
+                if search.table is not None:
+                    search.table.store(s.key, s.raw_score, s.raw_score, 0)
+            else:
+                batch.append(s)
+                keys.append(key)
+                boards.extend(game.heights)
+                boards.extend((game.holes, lock[0], lock[2], game.current_combo))
+            undo_game(game)
+
+        if batch != []:
+            features = batch_features(boards)
+            scores = score_batch(search.weights, features)
+            for s, key, row, score in zip(batch, keys, features.tolist(), scores.tolist()):
+                s.raw_score = score
+                if search.cache is not None:
+                    search.cache.store(key, row)
+                if search.table is not None:
+                    search.table.store(s.key, score, score, 0)
+
+    def add_subtrees(self, placements: List[Tuple[Tuple[str, ...], float]],
+                     search: SearchContext) -> None:
+        """Add a subtree for each (inputs, raw_score) placement already evaluated"""
+        for inputs, raw_score in placements:
+            s = GameTree(None, inputs, current=self.current + 1)
+            s.raw_score = raw_score
+            self.subtrees.append(s)
+        if search.stats is not None:
+            search.stats.generated += len(placements)
+            search.stats.depth = max(search.stats.depth, self.current)
+
+    def generate_beam(self, width: int, budget: Optional[SearchBudget] = None,
+                      pool: Optional[Executor] = None, chunks: Optional[int] = 1) -> None:
+        """Search the root's game_state with a beam: at each level of the tree only the width
+        best placements of the whole level are expanded, so the cost grows linearly with
+        max_height. Placements are ranked by the score of the path to them, which is scored
+        the way get_sub_score would score it if the placement were a leaf.
+
+        Each subtree of the root gets the best score of a path through it reaching the
+        deepest level the beam reached as its sub_score, or -inf if no such path goes through
+        it. Every placement evaluated is kept as a subtree so that the next search can reuse it.
+
+        Once the budget is spent no deeper level is searched, and a level left unfinished is not
+        used. The first level is always searched in full.
+
+        With a pool, the subtrees at the end of the beam are expanded in its processes, split
+        into chunks.
+
+        Preconditions:
+            - width >= 1
+            - chunks >= 1
+            - self.game_state is not None
+        """
+        game = self.game_state
+        search = self.search
+        start = snapshot_game(game)
+        # each entry is the score of the path so far, the subtree at its end, the subtree of the
+        # root it goes through, the snapshot of the game at its end and whether random garbage
+        # was received along it, so that the board may not be the one its subtrees were found on
+        frontier = [(0.0, self, None, start, False)]
+        best = {}
+        for level in range(1, search.max_height - self.current + 1):
+            if level > 1 and budget is not None and budget.spent():
+                break
+            # the subtrees at the end of the beam not expanded before, whose placements are new
+            fresh = set()
+            if search.stats is not None:
+                fresh = {id(t) for _, t, _, _, _ in frontier if t.subtrees == []}
+            if pool is not None:
+                expand_pool(game, [(t, snapshot) for _, t, _, snapshot, _ in frontier], search,
+                            pool, chunks)
+            candidates = []
+            new = set()
+            for path_score, tree, first, snapshot, randomized in frontier:
+                if level > 1 and budget is not None and budget.spent():
+                    break
+                restore_game(game, snapshot)
+                tree.expand(game, search, budget)
+                if id(tree) in fresh:
+                    new.update(id(s) for s in tree.subtrees)
+                for s in tree.subtrees:
+                    # the same weighting of raw scores down a path as get_sub_score
+                    candidates.append((path_score + s.raw_score / 2 ** (level - 1),
+                                       path_score + s.raw_score / 2 ** level,
+                                       s, first or s, snapshot, randomized))
+            if candidates == [] or (level > 1 and budget is not None and budget.spent()):
+                break
+
+            selecting = perf_counter() if search.stats is not None else 0.0
+            kept = nlargest(width, candidates, key=lambda c: c[0])
+            if search.stats is not None:
+                # placements from earlier searches were counted when they were first dropped
+                search.stats.pruned += len(new) - sum(1 for c in kept if id(c[2]) in new)
+                search.stats.selection += perf_counter() - selecting
+
+            best = {}
+            frontier = []
+            for score, path_score, s, first, snapshot, randomized in kept:
+                best[first] = max(best.get(first, score), score)
+                if level + self.current < search.max_height:
+                    restore_game(game, snapshot)
+                    if randomized:
+                        s.forget_placed()
+                    s.place(game)
+                    frontier.append((path_score, s, first, snapshot_game(game),
+                                     randomized or random_since_save(game)))
+                    undo_game(game)
+
+        restore_game(game, start)
+        self.sub_score = max(best.values(), default=self.raw_score)
+        for s in self.subtrees:
+            s.sub_score = best.get(s, float('-inf'))
+
+    def place(self, game: TetrominoGame) -> Tuple[int, List[int], int]:
+        """Place the inputs on game, the game of the parent tree, like place_piece and return the
+        result of the lock. Once placed is known the piece is locked there with place_piece_at
+        instead of making the inputs again, unless game was reached with random garbage and may
+        not be the board placed was found on. Sets placed. undo_game brings game back.
+        """
+        if self.placed is not None and self.placed[3] is not None \
+                and not random_since_save(game):
+            y, x, orientation, rotated = self.placed
+            return place_piece_at(game, y, x, orientation, rotated, self.inputs[:1] == ('hold',))
+        save_game(game)
+        game.do_inputs(self.inputs)
+        game.soft_drop()
+        self.placed = (game.piece_position[0], game.piece_position[1], game.piece_orientation,
+                       game.previous_action == 'rotate')
+        return game.lock_piece()
+
+    def lock(self, game: TetrominoGame, search: SearchContext) -> Tuple[int, List[int], int]:
+        """Place the inputs on game, the game of the parent tree, like place and return the
+        result of the lock. Sets placed and key. undo_game brings game back.
+        """
+        start = perf_counter() if search.stats is not None else 0.0
+        lock = self.place(game)
+        self.key = (state_hash(game), lock[0], lock[2], tuple(game.pending_garbage))
+        if search.stats is not None:
+            search.stats.simulation += perf_counter() - start
+        return lock
+
+    def evaluate_score(self, game: TetrominoGame, search: SearchContext) -> None:
+        """Calculate the score based on the weights of placing the inputs on game, the game of
+        the parent tree. game is left unchanged.
+        """
+        # move and lock the piece
+        lock = self.lock(game, search)
+
+        # the same state reached with the same lock is scored the same
+        if search.table is not None:
+            entry = search.table.get(self.key)
+            if entry is not None:
+                self.raw_score = entry[0]
+                undo_game(game)
+                return
+
+        if search.stats is not None:
+            search.stats.evaluated += 1
+
+        # the same board after the same lock has the same features
+        key = (game.board_hash, lock[0], lock[2], game.current_combo)
+        features = None
+        if search.cache is not None:
+            features = search.cache.get(key)
+        if features is None:
+            features = get_features(game, lock)
+            if search.cache is not None:
+                search.cache.store(key, features)
+        self.score_features(features, search)
+
+        if search.table is not None:
+            search.table.store(self.key, self.raw_score, self.raw_score, 0)
+        undo_game(game)
+
+    def score_features(self, features: List[int], search: SearchContext) -> None:
+        """Set raw_score to the score of the features given by get_features using the weights"""
+        weights = search.weights
+        rough, holes, height, deepest, attack, combo, clear = features
+        self.raw_score = 0
 
         # punish for rough field, do not consider the well
-        no_well = surface.copy()
-        no_well.pop(well[0])
-        rough = roughness(no_well)
-        self.raw_score += - rough * self.weights[0]
+        self.raw_score += - rough * weights[0]
 
         # punish holes in the board (empty cells with a filled cell somewhere above)
-        holes = self.find_holes(surface)
-        self.raw_score += - holes * self.weights[1]
+        self.raw_score += - holes * weights[1]
 
         # punish a high board to keep board low
-        height = max(surface)
-        self.raw_score += - height * self.weights[2]
+        self.raw_score += - height * weights[2]
 
         # punish height if above half of visible board to encourage downstacking a high board
-        self.raw_score += - max([0, height - 10]) * self.weights[3]
+        self.raw_score += - max([0, height - 10]) * weights[3]
 
         # punish height if above 3/4 of visible board to encourage downstacking a high board
-        self.raw_score += - max([0, height - 15]) * self.weights[4]
+        self.raw_score += - max([0, height - 15]) * weights[4]
 
         # reward a deep well
-        self.raw_score += well[1] * self.weights[5]
+        self.raw_score += deepest * weights[5]
 
         # reward higher attack numbers
-        self.raw_score += lock[0] * self.weights[6]
+        self.raw_score += attack * weights[6]
 
         # reward combo
-        self.raw_score += self.game_state.current_combo * self.weights[7]
+        self.raw_score += combo * weights[7]
 
         # punish clearing 1 or 2 lines without t-spin since little attack is sent
-        if lock[2] == 0 or lock[2] == 1:
-            self.raw_score += - self.weights[8]
+        if clear == 0 or clear == 1:
+            self.raw_score += - weights[8]
 
         # reward clearing 3-4 lines at a time, t-spins, and all clears
-        elif lock[2] == 2:
-            self.raw_score += self.weights[9]
-        elif lock[2] == 3 or lock[2] == 4 or lock[2] == 5 or lock[2] == 6 or lock[2] == 7:
-            self.raw_score += self.weights[10]
-        elif lock[2] == 8:
-            self.raw_score += self.weights[11]
+        elif clear == 2:
+            self.raw_score += weights[9]
+        elif clear == 3 or clear == 4 or clear == 5 or clear == 6 or clear == 7:
+            self.raw_score += weights[10]
+        elif clear == 8:
+            self.raw_score += weights[11]
+
+    def lookup_sub_score(self, search: SearchContext) -> bool:
+        """Set sub_score to the score in table of this state searched as deep as this tree
+        would be, and return whether there was one.
+        """
+        if search.table is None or self.key is None:
+            return False
+        entry = search.table.get(self.key)
+        if entry is None or entry[2] != search.max_height - self.current:
+            return False
+        self.sub_score = entry[1]
+        return True
 
     def reduce_current(self) -> None:
         """Reduce the value of current in preparation for regenerating subtrees after making a move
@@ -231,54 +825,38 @@ class GameTree:
             s.reduce_current()
         self.current -= 1
 
-    def get_sub_score(self) -> None:
+    def forget_placed(self) -> None:
+        """Find where this placement and those of the subtrees, all the way down, lock from
+        their inputs the next time they are placed, keeping where they last locked. Used when
+        the game at the parent tree may not be the board they were found on.
+        """
+        if self.placed is not None:
+            self.placed = self.placed[:3] + (None,)
+        for s in self.subtrees:
+            s.forget_placed()
+
+    def get_sub_score(self, search: Optional[SearchContext] = None) -> None:
         """Calculate the score taking into account subtrees"""
-        # no subtrees than sub_score is raw_score
-        if self.subtrees == []:
-            self.sub_score = self.raw_score
+        if search is None:
+            search = self.search
+        # no subtrees than sub_score is raw_score, unless the state was searched elsewhere.
+        # subtrees kept from a deeper search are not counted
+        if self.subtrees == [] or self.current >= search.max_height:
+            if not self.lookup_sub_score(search):
+                self.sub_score = self.raw_score
 
         # calculate the sub_score of subtrees use them to calculate sub_score
         else:
             max_so_far = -999999999
             for s in self.subtrees:
-                s.get_sub_score()
+                s.get_sub_score(search)
                 if s.sub_score > max_so_far:
                     max_so_far = s.sub_score
             self.sub_score = (self.raw_score + max_so_far) / 2
 
-    def find_holes(self, surface: List[int]) -> float:
-        """Return the number of empty spaces within the stack that have a filled space above"""
-        holes = 0
-        for i in range(0, 10):
-            for j in range(0, surface[i]):
-                if self.game_state.board[j][i] == '':
-                    holes += 1
-        return holes
-
-    def get_surface(self, ignore: List[List[int]]) -> List[int]:
-        """Get the highest filled position of each column"""
-        highest = [-1 for _ in range(0, 10)]
-        for i in range(0, 40):
-            row = self.game_state.board[i]
-            for j in range(0, 10):
-                if row[j] != '' and [i, j] not in ignore:
-                    highest[j] = i
-        return highest
-
-    def move(self) -> None:
-        """Make moves in inputs + soft drop"""
-        for i in self.inputs:
-            if i == 'cw':
-                self.game_state.rotate_cw()
-            elif i == 'ccw':
-                self.game_state.rotate_ccw()
-            elif i == 'left':
-                self.game_state.move_left()
-            elif i == 'right':
-                self.game_state.move_right()
-            elif i == 'hold':
-                self.game_state.hold_piece()
-        self.game_state.soft_drop()
+        if search.table is not None and self.key is not None:
+            search.table.store(self.key, self.raw_score, self.sub_score,
+                               search.max_height - self.current)
 
     def _str_indented(self, depth: int) -> str:
         """Return an indented string representation of this tree's moves (inputs).
@@ -298,71 +876,24 @@ class GameTree:
             return text
 
 
-def find_well(surface: List[int]) -> Tuple[int, int]:
-    """Return the position of the deepest well"""
-    well = 0
-    deepest = surface[0]
-    for i in range(1, len(surface)):
-        if deepest >= surface[i]:
-            well = i
-    return (well, deepest)
-
-
-def roughness(surface: List[int]) -> float:
-    """Add the roughness of the surface which is the sum of the absolute value of the change in
-    height of the top of the board given by a list representing the maximum height at each column.
+def garbage_shift(old: TetrominoGame, new: TetrominoGame) -> Optional[int]:
+    """Return how many more rows of garbage new has than old if the games are otherwise the
+    same apart from where the holes of their garbage are, or None if they are not. The rows
+    with 9 filled cells at the bottom of a board are taken to be its garbage.
     """
-    sum_so_far = 0
-    for i in range(0, len(surface) - 1):
-        sum_so_far += abs(surface[i] - surface[i - 1])
-    return sum_so_far
-
-
-def get_basic_placements(piece: str) -> List[List[str]]:
-    """Returns the moves for all basic piece placements. All rotations in all possible x positions
-    but without soft drops."""
-    if piece == 'o':
-        inputs = [[]]
-        for i in range(1, 5):
-            inputs.append(['left'] * i)
-            inputs.append(['right'] * i)
-        return inputs
-    elif piece == 'i':
-        inputs = [[], ['cw']]
-        for i in range(1, 4):
-            inputs.append(['left'] * i)
-            inputs.append(['right'] * i)
-            inputs.append(['cw'] + ['left'] * i)
-            inputs.append(['cw'] + ['right'] * i)
-        inputs.append(['cw'] + ['left'] * 4)
-        inputs.append(['cw'] + ['right'] * 4)
-        inputs.append(['cw'] + ['left'] * 5)
-        return inputs
-    elif piece in ('s', 'z'):
-        inputs = [[], ['cw']]
-        for i in range(1, 4):
-            inputs.append(['left'] * i)
-            inputs.append(['right'] * i)
-        inputs.append(['right'] * 4)
-        for i in range(1, 5):
-            inputs.append(['cw'] + ['left'] * i)
-            inputs.append(['cw'] + ['right'] * i)
-        return inputs
-    else:   # t, l, or j
-        inputs = [[], ['cw', 'cw'], ['cw'], ['ccw', 'right']]
-        for i in range(1, 4):
-            inputs.append(['left'] * i)
-            inputs.append(['right'] * i)
-            inputs.append(['cw', 'cw'] + ['left'] * i)
-            inputs.append(['cw', 'cw'] + ['right'] * i)
-        inputs.append(['right'] * 4)
-        inputs.append(['cw', 'cw'] + ['right'] * 4)
-        for i in range(1, 5):
-            inputs.append(['cw'] + ['left'] * i)
-            inputs.append(['cw'] + ['right'] * i)
-            inputs.append(['ccw'] + ['right'] + ['left'] * i)
-            inputs.append(['ccw'] + ['right'] + ['right'] * i)
-        return inputs
+    if state_hash(old) ^ old.board_hash != state_hash(new) ^ new.board_hash \
+            or old.pending_garbage != new.pending_garbage:
+        return None
+    old_garbage = 0
+    while old_garbage < 40 and old.row_counts[old_garbage] == 9:
+        old_garbage += 1
+    new_garbage = 0
+    while new_garbage < 40 and new.row_counts[new_garbage] == 9:
+        new_garbage += 1
+    shift = new_garbage - old_garbage
+    if shift < 0 or old.rows[old_garbage:40 - shift] != new.rows[new_garbage:]:
+        return None
+    return shift
 
 
 if __name__ == '__main__':
@@ -374,7 +905,8 @@ if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['copy', 'game'],  # the names (strs) of imported modules
+        'extra-imports': ['concurrent.futures', 'heapq', 'multiprocessing', 'time', 'game',
+                          'search', 'features'],  # the names (strs) of imported modules
         'allowed-io': [],  # the names (strs) of functions that call print/open/input
         'max-line-length': 100,
         'disable': ['E1136', 'R0902', 'R0913'],
@@ -0,0 +1,194 @@
+"""
+File for the features of the board after a placement and the scores they are given by weights
+"""
+from __future__ import annotations
+from typing import List, Tuple
+from game import TetrominoGame, place_piece, undo_game
+from search import get_placements
+
+# numpy is optional, without it placements are scored one at a time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def get_features(game: TetrominoGame, lock: Tuple[int, List[int], int]) -> List[int]:
+    """Return the features of game right after a placement with the result lock from
+    lock_piece: the roughness without the well, the holes, the height, the depth of the well,
+    the attack, the combo and the kind of clear.
+    """
+    rough, holes, height, _, deepest = board_features(game)
+    return [rough, holes, height, deepest, lock[0], game.current_combo, lock[2]]
+
+
+def board_features(game: TetrominoGame) -> List[int]:
+    """Return the features of the board of game in one pass over its column heights: the
+    roughness without the well, the holes, the height, the position of the well and the height
+    of the first column, which its depth is measured from.
+
+    The well is the last column no higher than the first, or the first column if there is none.
+    The roughness is the sum of the change in height between each column and the one before it
+    once the well is taken out, with the first column compared with the last instead of the
+    last with the one before it.
+    """
+    surface = game.heights
+    first = surface[0]
+    height = first
+    well = 0
+    # the change in height between each column and the one before it
+    changes = []
+    previous = first
+    for column in surface[1:]:
+        changes.append(abs(column - previous))
+        if column <= first:
+            well = len(changes)
+        if column > height:
+            height = column
+        previous = column
+
+    # changes is every neighbouring pair of the whole surface. Patch its sum up to the
+    # roughness: drop the two changes around the well and add the change between the columns
+    # it separated, then swap the change between the last two columns left for the one between
+    # the first and last. A well at either end or next to the last column shares columns with
+    # those pairs, so those cases are patched up on their own
+    rough = sum(changes)
+    last = len(surface) - 1
+    if well == 0:
+        rough += abs(surface[1] - surface[last]) - changes[0] - changes[last - 1]
+    elif well == last:
+        rough += abs(first - surface[last - 1]) - changes[last - 1] - changes[last - 2]
+    else:
+        rough += abs(surface[well + 1] - surface[well - 1]) - changes[well - 1] - changes[well]
+        rough += abs(first - surface[last])
+        if well == last - 1:
+            rough -= abs(surface[last] - surface[last - 2])
+        else:
+            rough -= changes[last - 1]
+    return [rough, game.holes, height, well, first]
+
+
+def batch_features(boards: List[int]) -> numpy.ndarray:
+    """Return the features get_features gives each of many boards as the rows of a matrix,
+    computed together with NumPy. boards is a flat list of 14 values for each board: the 10
+    column heights followed by the holes, attack, kind of clear and combo after its placement.
+
+    Preconditions:
+        - numpy is not None
+        - len(boards) >= 14 and len(boards) % 14 == 0
+    """
+    # a flat list converts much faster than a list of rows
+    boards = numpy.array(boards, dtype=numpy.int64).reshape(-1, 14)
+    surfaces = boards[:, :10]
+
+    # the well is the last column no higher than the first, or the first if there is none
+    well = ((surfaces[:, 1:] <= surfaces[:, :1]) * numpy.arange(1, 10)).max(axis=1)
+
+    # the roughness of the other 9 columns, comparing the first with the last instead of the
+    # last two
+    no_well = surfaces[numpy.arange(10) != well[:, None]].reshape(-1, 9)
+    rough = numpy.abs(no_well[:, 1:8] - no_well[:, :7]).sum(axis=1) \
+        + numpy.abs(no_well[:, 0] - no_well[:, 8])
+
+    return numpy.stack([rough, boards[:, 10], surfaces.max(axis=1), surfaces[:, 0],
+                        boards[:, 11], boards[:, 13], boards[:, 12]], axis=1)
+
+
+def score_batch(weights: List[float], features: numpy.ndarray) -> numpy.ndarray:
+    """Return the raw scores GameTree.score_features gives each row of features from
+    batch_features. The terms are added in the same order so the scores are exactly the same.
+
+    Preconditions:
+        - numpy is not None
+    """
+    height = features[:, 2]
+    scores = numpy.zeros(len(features))
+    scores += - features[:, 0] * weights[0]
+    scores += - features[:, 1] * weights[1]
+    scores += - height * weights[2]
+    scores += - numpy.maximum(0, height - 10) * weights[3]
+    scores += - numpy.maximum(0, height - 15) * weights[4]
+    scores += features[:, 3] * weights[5]
+    scores += features[:, 4] * weights[6]
+    scores += features[:, 5] * weights[7]
+    # the reward or punishment of each kind of clear, starting from no clear at -1
+    scores += numpy.array([0.0, - weights[8], - weights[8], weights[9]] + [weights[10]] * 5
+                          + [weights[11]])[features[:, 6] + 1]
+    return scores
+
+
+def linear_features(features: List[int]) -> List[int]:
+    """Return the 12 terms of features from get_features whose dot product with the weights
+    is the score GameTree.score_features gives them. The terms never depend on the weights.
+    """
+    rough, holes, height, deepest, attack, combo, clear = features
+    return [- rough, - holes, - height, - max(0, height - 10), - max(0, height - 15), deepest,
+            attack, combo, - int(clear == 0 or clear == 1), int(clear == 2),
+            int(3 <= clear <= 7), int(clear == 8)]
+
+
+def placement_features(game: TetrominoGame) -> Tuple[List[Tuple[str, ...]], List[List[int]]]:
+    """Return the inputs of every placement from game like get_placements, and the
+    linear_features right after each of them. game is left unchanged.
+    """
+    placements = get_placements(game)
+    features = []
+    for inputs in placements:
+        lock = place_piece(game, inputs)
+        features.append(linear_features(get_features(game, lock)))
+        undo_game(game)
+    return (placements, features)
+
+
+def score_population(population: List[List[float]], features: List[List[int]]) -> \
+        numpy.ndarray:
+    """Return the score each weights in population gives each row of features from
+    linear_features, all in one matrix multiply. Row i, column j is the score of row i by
+    member j. The terms are summed in another order than score_features, so the scores can
+    differ from it in the last bits. Raise ImportError if numpy is not installed.
+
+    Preconditions:
+        - features != []
+        - all(len(weights) == 12 for weights in population)
+    """
+    if numpy is None:
+        raise ImportError('scoring a population needs numpy, see requirements.txt')
+    return numpy.array(features, dtype=float) @ numpy.array(population, dtype=float).T
+
+
+def population_agreement(population: List[List[float]],
+                         positions: List[Tuple[List[List[int]], int]]) -> List[float]:
+    """Return the fraction of positions at which each weights in population scores the chosen
+    placement at least as high as every other. Each position is the linear_features of every
+    placement from it and the index of the placement chosen there. Every position is scored
+    by the whole population in one score_population, so numpy is needed like there.
+
+    Preconditions:
+        - positions != [] and all(rows != [] for rows, _ in positions)
+    """
+    starts = []
+    chosen = []
+    features = []
+    for rows, index in positions:
+        starts.append(len(features))
+        chosen.append(len(features) + index)
+        features.extend(rows)
+    scores = score_population(population, features)
+    best = numpy.maximum.reduceat(scores, starts, axis=0)
+    return (scores[chosen] >= best).mean(axis=0).tolist()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['numpy', 'game', 'search'],  # the names (strs) of imported modules
+        'allowed-io': [],  # the names (strs) of functions that call print/open/input
+        'max-line-length': 100,
+        'disable': ['E1136'],
+    })
@@ -1,6 +1,7 @@
 """
 File responsible for the mechanics of the game.
 """
+from __future__ import annotations
 from typing import List, Optional, Tuple
 from random import randint
 
@@ -9,6 +10,135 @@ COMBO_TABLE = [0, 0, 1, 1, 1, 2, 2, 3, 3, 4, 4, 4, 5]
 ATTACK_TABLE = [0, 1, 2, 4, 0, 2, 4, 6, 10]
 B2B_BONUS = 1
 
+# each row of the bitboard is a 10-bit integer where bit x is set if column x is filled
+FULL_ROW = (1 << 10) - 1
+POPCOUNT = [bin(mask).count('1') for mask in range(0, FULL_ROW + 1)]
+# the TetrominoGame methods for each input name
+INPUTS = {'cw': 'rotate_cw', 'ccw': 'rotate_ccw', '180': 'rotate_180', 'left': 'move_left',
+          'right': 'move_right', 'down': 'move_down', 'drop': 'soft_drop', 'hold': 'hold_piece'}
+
+# blocks of empty rows and garbage row counts indexed by the number of rows
+EMPTY_ROWS = [[0] * lines for lines in range(0, 41)]
+GARBAGE_COUNTS = [[9] * lines for lines in range(0, 41)]
+
+# the [dy, dx] offsets of the cells of each piece from the piece position for each orientation
+PIECE_CELLS = {
+    'l': [((0, -1), (0, 0), (0, 1), (1, 1)), ((1, 0), (0, 0), (-1, 0), (-1, 1)),
+          ((-1, -1), (0, -1), (0, 0), (0, 1)), ((1, -1), (1, 0), (0, 0), (-1, 0))],
+    'j': [((0, -1), (0, 0), (0, 1), (1, -1)), ((1, 0), (0, 0), (-1, 0), (1, 1)),
+          ((-1, 1), (0, -1), (0, 0), (0, 1)), ((-1, -1), (1, 0), (0, 0), (-1, 0))],
+    't': [((0, -1), (0, 0), (0, 1), (1, 0)), ((1, 0), (0, 0), (-1, 0), (0, 1)),
+          ((0, -1), (0, 0), (0, 1), (-1, 0)), ((-1, 0), (0, 0), (1, 0), (0, -1))],
+    's': [((0, -1), (0, 0), (1, 0), (1, 1)), ((1, 0), (0, 1), (0, 0), (-1, 1)),
+          ((0, 1), (0, 0), (-1, 0), (-1, -1)), ((1, -1), (0, -1), (0, 0), (-1, 0))],
+    'z': [((1, -1), (1, 0), (0, 0), (0, 1)), ((1, 1), (0, 1), (0, 0), (-1, 0)),
+          ((0, -1), (-1, 0), (0, 0), (-1, 1)), ((1, 0), (0, -1), (0, 0), (-1, -1))],
+    'o': [((0, 1), (1, 0), (0, 0), (1, 1))] * 4,
+    'i': [((0, -1), (0, 0), (0, 1), (0, 2)), ((1, 0), (0, 0), (-1, 0), (-2, 0)),
+          ((0, -2), (0, -1), (0, 0), (0, 1)), ((2, 0), (1, 0), (0, 0), (-1, 0))],
+}
+
+# the [dy, dx] kicks tried in order when rotating from one orientation to another
+JLSTZ_KICKS = {
+    (0, 1): ((0, 0), (0, -1), (1, -1), (-2, 0), (-2, -1)),
+    (1, 2): ((0, 0), (0, 1), (-1, 1), (2, 0), (2, 1)),
+    (2, 3): ((0, 0), (0, 1), (1, 1), (-2, 0), (-2, 1)),
+    (3, 0): ((0, 0), (0, -1), (-1, -1), (2, 0), (2, -1)),
+    (0, 3): ((0, 0), (0, 1), (1, 1), (-2, 0), (-2, 1)),
+    (3, 2): ((0, 0), (0, -1), (-1, -1), (2, 0), (2, -1)),
+    (2, 1): ((0, 0), (0, -1), (1, -1), (-2, 0), (-2, -1)),
+    (1, 0): ((0, 0), (0, 1), (-1, 1), (2, 0), (2, 1)),
+    (0, 2): ((0, 0),), (1, 3): ((0, 0),), (2, 0): ((0, 0),), (3, 1): ((0, 0),),
+}
+# the position of the i piece is not its centre so its first kick also moves the piece
+I_KICKS = {
+    (0, 1): ((0, 1), (0, -1), (0, 2), (-1, -1), (2, 2)),
+    (1, 2): ((-1, 0), (-1, -1), (-1, 2), (1, -1), (-2, 2)),
+    (2, 3): ((0, -1), (0, 1), (0, -2), (1, 1), (-2, -2)),
+    (3, 0): ((1, 0), (1, 1), (1, -2), (-1, 1), (2, -2)),
+    (0, 3): ((-1, 0), (-1, -1), (-1, 2), (1, -1), (-2, 2)),
+    (3, 2): ((1, 0), (-1, 0), (2, 0), (-1, -1), (2, 2)),
+    (2, 1): ((1, 0), (1, 1), (1, -2), (-1, 1), (2, -2)),
+    (1, 0): ((0, -1), (0, 1), (0, -2), (1, 1), (-2, -2)),
+    (0, 2): ((-1, 1),), (1, 3): ((-1, -1),), (2, 0): ((1, -1),), (3, 1): ((1, 1),),
+}
+# the o piece does not rotate
+KICKS = {'j': JLSTZ_KICKS, 'l': JLSTZ_KICKS, 's': JLSTZ_KICKS, 't': JLSTZ_KICKS,
+         'z': JLSTZ_KICKS, 'i': I_KICKS, 'o': {}}
+
+# the (min_y, max_y, min_x, max_x) range of piece positions that keep every cell on the board
+PIECE_BOUNDS = {
+    piece: [(-min(dy for dy, _ in cells), 39 - max(dy for dy, _ in cells),
+             -min(dx for _, dx in cells), 9 - max(dx for _, dx in cells))
+            for cells in PIECE_CELLS[piece]]
+    for piece in PIECE_CELLS
+}
+
+
+def _row_masks(cells: Tuple[Tuple[int, int], ...], x: int) -> Tuple[Tuple[int, int], ...]:
+    """Return the (dy, mask) pairs covered by the cells when the piece is in column x"""
+    masks = {}
+    for dy, dx in cells:
+        if 0 <= x + dx <= 9:
+            masks[dy] = masks.get(dy, 0) | 1 << (x + dx)
+    return tuple(sorted(masks.items()))
+
+
+# the bitboard rows covered by each piece, indexed by piece, orientation and then column
+PIECE_MASKS = {
+    piece: [[_row_masks(cells, x) for x in range(0, 10)] for cells in PIECE_CELLS[piece]]
+    for piece in PIECE_CELLS
+}
+
+# the (dx, dy) of the lowest cell in each column covered by each piece and orientation
+PIECE_BOTTOMS = {
+    piece: [tuple((dx, min(dy for dy, cell_dx in cells if cell_dx == dx))
+                  for dx in sorted({cell_dx for _, cell_dx in cells}))
+            for cells in PIECE_CELLS[piece]]
+    for piece in PIECE_CELLS
+}
+
+MASK_64 = (1 << 64) - 1
+
+
+def _mix(value: int) -> int:
+    """Return a well scrambled 64-bit key for the integer value (the splitmix64 finalizer)"""
+    value = (value + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+
+def _row_keys(cell_keys: List[int]) -> List[int]:
+    """Return the xor of the keys of the filled cells for every row of the bitboard"""
+    keys = [0] * (FULL_ROW + 1)
+    for mask in range(1, FULL_ROW + 1):
+        lowest = mask & -mask
+        keys[mask] = keys[mask ^ lowest] ^ cell_keys[lowest.bit_length() - 1]
+    return keys
+
+
+# the zobrist keys of each filled cell [y][x], and of each whole row [y][row] of the bitboard
+ZOBRIST_CELLS = [[_mix(y * 10 + x) for x in range(0, 10)] for y in range(0, 40)]
+ZOBRIST_ROWS = [_row_keys(cells) for cells in ZOBRIST_CELLS]
+# the zobrist keys of the current piece, the held piece, having held and back-to-back
+ZOBRIST_PIECES = {piece: _mix(400 + i) for i, piece in enumerate('ijlszot')}
+ZOBRIST_HELD = {piece: _mix(410 + i) for i, piece in enumerate('ijlszot')}
+ZOBRIST_HELD[''] = 0
+ZOBRIST_HOLD = _mix(420)
+ZOBRIST_B2B = _mix(421)
+# the keys of queue positions and combos are made on demand from these offsets
+ZOBRIST_QUEUE = 1 << 32
+ZOBRIST_COMBO = 2 << 32
+
+
+def board_hash(rows: List[int]) -> int:
+    """Return the zobrist hash of the filled cells of the bitboard rows"""
+    value = 0
+    for y in range(0, 40):
+        value ^= ZOBRIST_ROWS[y][rows[y]]
+    return value
+
 
 class TetrominoGame:
     """An instance of TetrominoGame
@@ -19,9 +149,21 @@ class TetrominoGame:
     These same values will be stored in the board along with '' representing nothing
     and 'g' representing gray garbage
 
+    The engine itself only looks at the bitboard in rows. The board of one-character strings
+    is a colour layer kept for rendering and can be turned off for games that are never drawn
+    (such as the copies searched by the AI).
+
     Instance Attributes:
         - board: a 40 length list of 10 length lists representing a 40 tall 10 wide board,
-        only the first 20 rows are shown and the top 20 are hidden but still stored
+        only the first 20 rows are shown and the top 20 are hidden but still stored. The current
+        piece is drawn in the board. Empty if colours is False
+        - rows: a 40 length list of 10-bit integers representing the same board where bit x of
+        rows[y] is set if the cell at [y, x] is filled. The current piece is not included
+        - heights: the highest filled row of each column of rows, -1 if the column is empty
+        - row_counts: the number of filled cells in each row of rows
+        - holes: the number of empty cells of rows that have a filled cell somewhere above
+        - board_hash: the zobrist hash of the filled cells of rows
+        - colours: whether the board colour layer is kept up to date
         - queue: the piece queue of the current game
         - queue_position: the piece in the queue the game is at
         - current_combo: the number of consecutive block placements that have resulted
@@ -40,10 +182,19 @@ class TetrominoGame:
         - pending_garbage: a list of pending garbage, cleared after received
         - previous_action: the previous change be it rotation, hard drop, etc. for t-spin detection
         - game_over: whether the game is over or not
+        - history: a record from save_game of each state the game can be brought back to with
+        undo_game, with the changes made to the bitboard since, used to undo placements in
+        reverse order
 
     Representation Invariants:
-        - len(self.board) == 40
+        - len(self.board) == 40 or (not self.colours and self.board == [])
         - all(len(row) == 10 for row in self.board)
+        - len(self.rows) == 40
+        - all(0 <= row <= FULL_ROW for row in self.rows)
+        - len(self.heights) == 10 and all(-1 <= height <= 39 for height in self.heights)
+        - self.row_counts == [POPCOUNT[row] for row in self.rows]
+        - self.holes >= 0
+        - self.board_hash == board_hash(self.rows)
         - all(all(value in ('i', 'j', 'l', 's', 'z', 'o', 't', 'g', '') for value in row)
         for row in self.board)
         - all(piece in ('i', 'j', 'l', 's', 'z', 'o', 't') for piece in self.queue)
@@ -59,6 +210,12 @@ class TetrominoGame:
         - all(type(value) is int for value in self.pending_garbage)
     """
     board: list
+    rows: list
+    heights: list
+    row_counts: list
+    holes: int
+    board_hash: int
+    colours: bool
     queue: list
     queue_position: int
     current_combo: int
@@ -74,10 +231,20 @@ class TetrominoGame:
     pending_garbage: list
     previous_action: str
     game_over: bool
+    history: list
 
-    def __init__(self, queue: List[str]) -> None:
+    def __init__(self, queue: List[str], colours: Optional[bool] = True) -> None:
         """Initialize a new TetrominoGame"""
-        self.board = [['' for _ in range(0, 10)] for _ in range(0, 40)]
+        self.colours = colours
+        if colours:
+            self.board = [['' for _ in range(0, 10)] for _ in range(0, 40)]
+        else:
+            self.board = []
+        self.rows = [0] * 40
+        self.heights = [-1] * 10
+        self.row_counts = [0] * 40
+        self.holes = 0
+        self.board_hash = 0
         self.queue = queue.copy()
         self.queue_position = -1
         self.current_combo = -1
@@ -90,9 +257,15 @@ class TetrominoGame:
         self.pending_garbage = []
         self.previous_action = ''
         self.game_over = False
+        self.history = []
         self.next_piece()
         self.total_attack = 0
 
+    def do_inputs(self, inputs: List[str]) -> None:
+        """Make each input in inputs in order. Each input is a key of INPUTS."""
+        for i in inputs:
+            getattr(self, INPUTS[i])()
+
     def get_piece(self, pos: int) -> str:
         """Returns a piece where 0 is the current piece, 1 is the next piece, etc."""
         if self.hold is False or pos != 0:
@@ -107,14 +280,17 @@ class TetrominoGame:
         self.queue_position += 1
         self.piece_position = [19, 4]
         self.piece_orientation = 0
-        filled = get_filled(self.get_piece(0), self.piece_position, self.piece_orientation)
-        if any(self.board[p[0]][p[1]] != '' for p in filled):
+        piece = self.get_piece(0)
+        if not fits(self.rows, piece, self.piece_position, self.piece_orientation):
             self.game_over = True
-        for pos in filled:
-            self.board[pos[0]][pos[1]] = self.get_piece(0)
+        if self.colours:
+            for pos in get_filled(piece, self.piece_position, self.piece_orientation):
+                self.board[pos[0]][pos[1]] = piece
 
     def change_board(self, new_pos: List[int], new_orientation: int) -> None:
-        """Erases the current position and fills in the new position"""
+        """Erases the current position and fills in the new position of the colour layer"""
+        if not self.colours:
+            return
         piece = self.get_piece(0)
         current = get_filled(piece, self.piece_position, self.piece_orientation)
         for pos in current:
@@ -129,17 +305,13 @@ class TetrominoGame:
         If not, return 'not moved'.
         """
         piece = self.get_piece(0)
-        current = get_filled(piece, self.piece_position, self.piece_orientation)
-        tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 1],
-                           self.piece_orientation)
-        if tiled is not None:
-            if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                self.change_board([self.piece_position[0], self.piece_position[1] - 1],
-                                  self.piece_orientation)
-                self.piece_orientation = self.piece_orientation
-                self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
-                self.previous_action = 'move'
-                return 'moved'
+        if fits(self.rows, piece, [self.piece_position[0], self.piece_position[1] - 1],
+                     self.piece_orientation):
+            self.change_board([self.piece_position[0], self.piece_position[1] - 1],
+                              self.piece_orientation)
+            self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
+            self.previous_action = 'move'
+            return 'moved'
         return 'not moved'
 
     def das_left(self) -> None:
@@ -155,17 +327,13 @@ class TetrominoGame:
         If not, return 'not moved'.
         """
         piece = self.get_piece(0)
-        current = get_filled(piece, self.piece_position, self.piece_orientation)
-        tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 1],
-                           self.piece_orientation)
-        if tiled is not None:
-            if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                self.change_board([self.piece_position[0], self.piece_position[1] + 1],
-                                  self.piece_orientation)
-                self.piece_orientation = self.piece_orientation
-                self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
-                self.previous_action = 'move'
-                return 'moved'
+        if fits(self.rows, piece, [self.piece_position[0], self.piece_position[1] + 1],
+                     self.piece_orientation):
+            self.change_board([self.piece_position[0], self.piece_position[1] + 1],
+                              self.piece_orientation)
+            self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
+            self.previous_action = 'move'
+            return 'moved'
         return 'not moved'
 
     def das_right(self) -> None:
@@ -179,10 +347,11 @@ class TetrominoGame:
         """Try to hold the current piece."""
         if self.hold is False:
             # erase current piece
-            current = get_filled(self.get_piece(0), self.piece_position,
-                                 self.piece_orientation)
-            for pos in current:
-                self.board[pos[0]][pos[1]] = ''
+            if self.colours:
+                current = get_filled(self.get_piece(0), self.piece_position,
+                                     self.piece_orientation)
+                for pos in current:
+                    self.board[pos[0]][pos[1]] = ''
             # hold piece
             if self.held == '':
                 self.held = self.queue[self.queue_position]
@@ -203,17 +372,13 @@ class TetrominoGame:
         If not, return 'not moved'.
         """
         piece = self.get_piece(0)
-        current = get_filled(piece, self.piece_position, self.piece_orientation)
-        tiled = get_filled(piece, [self.piece_position[0] - 1, self.piece_position[1]],
-                           self.piece_orientation)
-        if tiled is not None:
-            if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                self.change_board([self.piece_position[0] - 1, self.piece_position[1]],
-                                  self.piece_orientation)
-                self.piece_orientation = self.piece_orientation
-                self.piece_position = [self.piece_position[0] - 1, self.piece_position[1]]
-                self.previous_action = 'move'
-                return 'moved'
+        if fits(self.rows, piece, [self.piece_position[0] - 1, self.piece_position[1]],
+                     self.piece_orientation):
+            self.change_board([self.piece_position[0] - 1, self.piece_position[1]],
+                              self.piece_orientation)
+            self.piece_position = [self.piece_position[0] - 1, self.piece_position[1]]
+            self.previous_action = 'move'
+            return 'moved'
         return 'not moved'
 
     def hard_drop(self) -> None:
@@ -223,10 +388,16 @@ class TetrominoGame:
 
     def soft_drop(self) -> None:
         """Move the piece as far down as possible without locking the piece"""
-        for _ in range(0, 40):
-            move = self.move_down()
-            if move == 'not moved':
-                return
+        y = self._drop_row()
+        if y != self.piece_position[0]:
+            self.change_board([y, self.piece_position[1]], self.piece_orientation)
+            self.piece_position = [y, self.piece_position[1]]
+            self.previous_action = 'move'
+
+    def _drop_row(self) -> int:
+        """Return the row the current piece would stop at if moved as far down as possible"""
+        return landing_row(self.rows, self.heights, self.get_piece(0), self.piece_position,
+                           self.piece_orientation)
 
     def accept_pending(self, no_lines: int) -> None:
         """Accept one pending attack by adding a garbage layer to the bottom of the board.
@@ -234,18 +405,95 @@ class TetrominoGame:
         a 'g' for garbage. A garbage row is a full row of 'g's in the board with one empty cell
         in the row determined randomly. This empty row is the same row for all of the same attack.
         """
-        garbage = ['g' for x in range(0, 10)]
         random = randint(0, 9)
-        garbage[random] = ''
-        for _ in range(0, no_lines):
-            self.board.insert(0, garbage.copy())
-            self.board.pop()
+        self._insert_garbage(no_lines, random)
+
+        # every column rises except an empty column above the garbage hole, which only
+        # gains holes if something is already in it
+        if self.heights[random] != -1:
+            self.holes += no_lines
+        for x in range(0, 10):
+            if self.heights[x] != -1 or x != random:
+                self.heights[x] += no_lines
+        if max(self.heights) > 39:
+            # cells were pushed off the top of the board
+            recount(self)
+
+    def _insert_garbage(self, no_lines: int, hole: int) -> None:
+        """Push the rows up and fill the bottom no_lines rows with garbage with an empty cell in
+        the hole column. Rows pushed off the top are reused for the garbage in the colour layer.
+        """
+        no_lines = min(no_lines, 40)
+        if self.history:
+            self.history[-1][-1].append(('garbage', no_lines, self.rows[40 - no_lines:]))
+        self.rows[0:0] = [FULL_ROW & ~(1 << hole)] * no_lines
+        del self.rows[40:]
+        self.row_counts[0:0] = GARBAGE_COUNTS[no_lines]
+        del self.row_counts[40:]
+        self.board_hash = board_hash(self.rows)
+        if self.colours:
+            reused = self.board[40 - no_lines:]
+            del self.board[40 - no_lines:]
+            for row in reused:
+                for x in range(0, 10):
+                    row[x] = 'g'
+                row[hole] = ''
+            self.board[0:0] = reused
+
+    def _remove_rows(self, tiled: List[int]) -> None:
+        """Remove the tiled rows and add as many empty rows at the top. Removed rows are reused
+        as the new empty rows in the colour layer.
+
+        Preconditions:
+            - tiled == sorted(tiled)
+        """
+        if self.history:
+            self.history[-1][-1].append(('clear', tiled))
+        for i in range(len(tiled) - 1, -1, -1):
+            del self.rows[tiled[i]]
+            del self.row_counts[tiled[i]]
+        self.rows.extend(EMPTY_ROWS[len(tiled)])
+        self.row_counts.extend(EMPTY_ROWS[len(tiled)])
+        self.board_hash = board_hash(self.rows)
+        if self.colours:
+            reused = [self.board[i] for i in tiled]
+            for i in range(len(tiled) - 1, -1, -1):
+                del self.board[tiled[i]]
+            for row in reused:
+                for x in range(0, 10):
+                    row[x] = ''
+            self.board.extend(reused)
 
     def lock_piece(self) -> Tuple[int, List[int], int]:
         """Lock the current piece and check for line clears and t-spin. Return a tuple of
         the raw attack, tiled rows, and the value of the kind of clear in the attack table.
         If nothing is cleared, the third value (the value identifying the kind of clear) is -1.
         """
+        # add the piece to the bitboard
+        y, x = self.piece_position
+        heights = self.heights
+        if self.history:
+            # the rows the piece covers, as they were
+            masks = PIECE_MASKS[self.get_piece(0)][self.piece_orientation][x]
+            low = y + masks[0][0]
+            high = y + masks[-1][0] + 1
+            self.history[-1][-1].append(('lock', low, self.rows[low:high],
+                                         self.row_counts[low:high]))
+        for dy, dx in PIECE_CELLS[self.get_piece(0)][self.piece_orientation]:
+            if self.rows[y + dy] >> x + dx & 1:
+                # the piece can only overlap the stack after the game is over
+                continue
+            self.rows[y + dy] |= 1 << x + dx
+            self.row_counts[y + dy] += 1
+            self.board_hash ^= ZOBRIST_CELLS[y + dy][x + dx]
+            if y + dy > heights[x + dx]:
+                # any gap below a cell placed above the column is new holes
+                self.holes += y + dy - heights[x + dx] - 1
+                heights[x + dx] = y + dy
+            else:
+                # a cell placed below the top of the column fills a hole
+                self.holes -= 1
+
         self.hold = False
         raw_attack = 0
         placement_type = -1
@@ -290,12 +538,18 @@ class TetrominoGame:
             attack += COMBO_TABLE[min(self.current_combo, 12)]
 
             # remove tiled rows
-            for i in range(0, len(tiled)):
-                self.board.pop(tiled[len(tiled) - i - 1])
-                self.board.append(['' for _ in range(0, 10)])
+            self._remove_rows(tiled)
+
+            # every column had a cell in each tiled row, holes under the new top are uncovered
+            for i in range(0, 10):
+                height = heights[i] - len(tiled)
+                while height >= 0 and not self.rows[height] >> i & 1:
+                    height -= 1
+                    self.holes -= 1
+                heights[i] = height
 
             # check for all clear
-            if all(all(item == '' for item in row) for row in self.board):
+            if not any(self.rows):
                 attack = ATTACK_TABLE[8]
                 placement_type = 8
 
@@ -324,7 +578,7 @@ class TetrominoGame:
 
         # check only around the current piece position for clears
         for i in range(self.piece_position[0] - 3, self.piece_position[0] + 4):
-            if all(value != '' for value in self.board[i]):
+            if self.rows[i] == FULL_ROW:
                 tiled.append(i)
         return tiled
 
@@ -334,64 +588,7 @@ class TetrominoGame:
         """
         if self.previous_action != 'rotate':
             return 'no'
-
-        # t-piece is at left wall
-        if self.piece_position[1] == 0:
-            if self.board[self.piece_position[0] - 1][self.piece_position[1] + 1] != '' \
-                    and self.board[self.piece_position[0] + 1][self.piece_position[1] + 1] != '':
-                return 't'
-            elif self.board[self.piece_position[0] - 1][self.piece_position[1] + 1] != '' \
-                    or self.board[self.piece_position[0] + 1][self.piece_position[1] + 1] != '':
-                return 'mini'
-            else:
-                return 'no'
-
-        # t-piece is at right wall
-        if self.piece_position[1] == 9:
-            if self.board[self.piece_position[0] - 1][self.piece_position[1] - 1] != '' \
-                    and self.board[self.piece_position[0] + 1][self.piece_position[1] - 1] != '':
-                return 't'
-            elif self.board[self.piece_position[0] - 1][self.piece_position[1] - 1] != '' \
-                    or self.board[self.piece_position[0] + 1][self.piece_position[1] - 1] != '':
-                return 'mini'
-            else:
-                return 'no'
-
-        # t-piece is flat at the bottom
-        if self.piece_position[0] == 0:
-            if self.board[self.piece_position[0] + 1][self.piece_position[1] + 1] != '' \
-                    or self.board[self.piece_position[0] + 1][self.piece_position[1] - 1] != '':
-                return 'mini'
-            else:
-                return 'no'
-
-        # any other case
-        missing_corners = []
-        if self.board[self.piece_position[0] + 1][self.piece_position[1] + 1] == '':
-            missing_corners.append('tr')
-        if self.board[self.piece_position[0] + 1][self.piece_position[1] - 1] == '':
-            missing_corners.append('tl')
-        if self.board[self.piece_position[0] - 1][self.piece_position[1] + 1] == '':
-            missing_corners.append('br')
-        if self.board[self.piece_position[0] - 1][self.piece_position[1] - 1] == '':
-            missing_corners.append('bl')
-
-        # missing more than one corner means it is not a 't' or mini' kind of spin
-        if len(missing_corners) > 1:
-            return 'no'
-
-        # if the middle part of the T has a missing corner on either side, it is a 'mini'
-        if self.piece_orientation == 0 and ('tr' in missing_corners or 'tl' in missing_corners):
-            return 'mini'
-        if self.piece_orientation == 1 and ('tr' in missing_corners or 'br' in missing_corners):
-            return 'mini'
-        if self.piece_orientation == 2 and ('bl' in missing_corners or 'br' in missing_corners):
-            return 'mini'
-        if self.piece_orientation == 3 and ('bl' in missing_corners or 'tl' in missing_corners):
-            return 'mini'
-
-        # otherwise it is a t-spin
-        return 't'
+        return t_spin_type(self.rows, self.piece_position, self.piece_orientation)
 
     def get_app(self) -> float:
         """Returns the attack per piece (APP) used of the game"""
@@ -400,825 +597,375 @@ class TetrominoGame:
         else:
             return 0
 
-    def rotate_cw(self) -> None:
+    def _rotate(self, turns: int) -> str:
+        """Rotate the current piece clockwise by the given number of quarter turns, if possible.
+        Try each kick in the kick table of the piece for the orientation change in order, the
+        first being the rotation about the centre of the piece. If no kick works, do not rotate
+        the piece. If the piece is rotated, return 'moved'. If not, return 'not moved'.
+        """
+        piece = self.get_piece(0)
+        orientation = (self.piece_orientation + turns) % 4
+        y, x = self.piece_position
+        for dy, dx in KICKS[piece].get((self.piece_orientation, orientation), ()):
+            if fits(self.rows, piece, [y + dy, x + dx], orientation):
+                self.change_board([y + dy, x + dx], orientation)
+                self.piece_orientation = orientation
+                self.piece_position = [y + dy, x + dx]
+                self.previous_action = 'rotate'
+                return 'moved'
+        return 'not moved'
+
+    def rotate_cw(self) -> str:
         """Rotate the current piece clockwise, if possible. First check the rotation about the
         centre of the piece. If the rotation is not possible, kick the piece into other
         position until the rotation works or until running out of possible kicks. In that case,
         do not rotate the piece.
         """
-        piece = self.get_piece(0)
-        current = get_filled(piece, self.piece_position, self.piece_orientation)
-
-        # kick table is the same for ljtsz
-        if piece not in ('o', 'i'):
-            if self.piece_orientation == 0:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1]], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1]], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0], self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] - 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] - 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2, self.piece_position[1]], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2, self.piece_position[1]], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] - 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2,
-                                           self.piece_position[1] - 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2,
-                                           self.piece_position[1] - 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] - 2,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 1:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1]], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1]], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0], self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] + 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] + 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] + 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2, self.piece_position[1]], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2, self.piece_position[1]], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] + 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2,
-                                           self.piece_position[1] + 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2,
-                                           self.piece_position[1] + 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] + 2,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 2:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1]], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1]], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0], self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] + 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2, self.piece_position[1]], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2, self.piece_position[1]], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2,
-                                           self.piece_position[1] + 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2,
-                                           self.piece_position[1] + 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 2,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 3:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1]], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1]], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0], self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2, self.piece_position[1]], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2, self.piece_position[1]], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2,
-                                           self.piece_position[1] - 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2,
-                                           self.piece_position[1] - 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 2,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                return
-
-        # different kick table for i
-        if piece == 'i':
-            if self.piece_orientation == 0:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] + 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 2], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] + 2], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] + 2]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2,
-                                           self.piece_position[1] + 2], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2,
-                                           self.piece_position[1] + 2], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] + 2,
-                                               self.piece_position[1] + 2]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 1:
-                tiled = get_filled(piece, [self.piece_position[0] - 1, self.piece_position[1]], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1, self.piece_position[1]], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] - 1, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] + 2], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] + 2], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] + 2]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] - 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] - 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2,
-                                           self.piece_position[1] + 2], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2,
-                                           self.piece_position[1] + 2], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] - 2,
-                                               self.piece_position[1] + 2]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 2:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] + 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 2], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 2], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 2]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2,
-                                           self.piece_position[1] - 2], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2,
-                                           self.piece_position[1] - 2], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 2,
-                                               self.piece_position[1] - 2]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 3:
-                tiled = get_filled(piece, [self.piece_position[0] + 1, self.piece_position[1]], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1, self.piece_position[1]], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 1, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] - 2], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] - 2], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] - 2]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] + 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] + 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2,
-                                           self.piece_position[1] - 2], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2,
-                                           self.piece_position[1] - 2], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 2,
-                                               self.piece_position[1] - 2]
-                        self.previous_action = 'rotate'
-                        return
-                return
+        return self._rotate(1)
 
-    def rotate_ccw(self) -> None:
+    def rotate_ccw(self) -> str:
         """Rotate the current piece counterclockwise, if possible. First check the rotation about
         the centre of the piece. If the rotation is not possible, kick the piece into other
         position until the rotation works or until running out of possible kicks. In that case,
         do not rotate the piece. """
-        piece = self.get_piece(0)
-        current = get_filled(piece, self.piece_position, self.piece_orientation)
+        return self._rotate(3)
 
-        # kick table is the same for ljtsz
-        if piece not in ('o', 'i'):
-            if self.piece_orientation == 0:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1]], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1]], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0], self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] + 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2, self.piece_position[1]], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2, self.piece_position[1]], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2,
-                                           self.piece_position[1] + 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2,
-                                           self.piece_position[1] + 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 2,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 3:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1]], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1]], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0], self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2, self.piece_position[1]], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2, self.piece_position[1]], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] + 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2,
-                                           self.piece_position[1] - 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2,
-                                           self.piece_position[1] - 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] + 2,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 2:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1]], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1]], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0], self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] - 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] - 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2, self.piece_position[1]], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2, self.piece_position[1]], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] - 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2,
-                                           self.piece_position[1] - 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2,
-                                           self.piece_position[1] - 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] - 2,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 1:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1]], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1]], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0], self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] + 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] + 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] + 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2, self.piece_position[1]], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2, self.piece_position[1]], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2,
-                                           self.piece_position[1] + 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2,
-                                           self.piece_position[1] + 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 2,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                return
-        # different kick table for i
-        if piece == 'i':
-            if self.piece_orientation == 0:
-                tiled = get_filled(piece, [self.piece_position[0] - 1, self.piece_position[1]], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1, self.piece_position[1]], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 1, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] + 2], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] + 2], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] + 2]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] - 1], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] - 1], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2,
-                                           self.piece_position[1] + 2], 3)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2,
-                                           self.piece_position[1] + 2], 3)
-                        self.piece_orientation = 3
-                        self.piece_position = [self.piece_position[0] - 2,
-                                               self.piece_position[1] + 2]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 3:
-                tiled = get_filled(piece, [self.piece_position[0] + 1, self.piece_position[1]], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1, self.piece_position[1]], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] + 1, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1, self.piece_position[1]], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1, self.piece_position[1]], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] - 1, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2, self.piece_position[1]], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2, self.piece_position[1]], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] + 2, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] - 1], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2,
-                                           self.piece_position[1] + 2], 2)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2,
-                                           self.piece_position[1] + 2], 2)
-                        self.piece_orientation = 2
-                        self.piece_position = [self.piece_position[0] + 2,
-                                               self.piece_position[1] + 2]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 2:
-                tiled = get_filled(piece, [self.piece_position[0] + 1, self.piece_position[1]], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1, self.piece_position[1]], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] + 1, self.piece_position[1]]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] - 2], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] - 2], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] - 2]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 1,
-                                           self.piece_position[1] + 1], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 1,
-                                           self.piece_position[1] + 1], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] - 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 2,
-                                           self.piece_position[1] - 2], 1)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 2,
-                                           self.piece_position[1] - 2], 1)
-                        self.piece_orientation = 1
-                        self.piece_position = [self.piece_position[0] + 2,
-                                               self.piece_position[1] - 2]
-                        self.previous_action = 'rotate'
-                        return
-                return
-            if self.piece_orientation == 1:
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] + 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] + 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0], self.piece_position[1] - 2], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0], self.piece_position[1] - 2], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0], self.piece_position[1] - 2]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] + 1,
-                                           self.piece_position[1] + 1], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] + 1,
-                                               self.piece_position[1] + 1]
-                        self.previous_action = 'rotate'
-                        return
-                tiled = get_filled(piece, [self.piece_position[0] - 2,
-                                           self.piece_position[1] - 2], 0)
-                if tiled is not None:
-                    if all(self.board[pos[0]][pos[1]] == '' or pos in current for pos in tiled):
-                        self.change_board([self.piece_position[0] - 2,
-                                           self.piece_position[1] - 2], 0)
-                        self.piece_orientation = 0
-                        self.piece_position = [self.piece_position[0] - 2,
-                                               self.piece_position[1] - 2]
-                        self.previous_action = 'rotate'
-                        return
-                return
+    def rotate_180(self) -> str:
+        """Rotate the current piece by a half turn, if possible. There are no kicks for a
+        half turn so the piece is only rotated in place.
+        """
+        return self._rotate(2)
+
+
+def clone_game(game: TetrominoGame, colours: Optional[bool] = False) -> TetrominoGame:
+    """Return a copy of game. The copy shares the queue, which is never mutated, and only
+    keeps the colour layer if colours is True and game has one.
+    """
+    copy = TetrominoGame.__new__(TetrominoGame)
+    copy.__dict__.update(game.__dict__)
+    copy.rows = game.rows.copy()
+    copy.heights = game.heights.copy()
+    copy.row_counts = game.row_counts.copy()
+    copy.sent_garbage = game.sent_garbage.copy()
+    copy.pending_garbage = game.pending_garbage.copy()
+    copy.history = []
+    copy.colours = colours and game.colours
+    if copy.colours:
+        copy.board = [row.copy() for row in game.board]
+    else:
+        copy.board = []
+    return copy
+
+
+def snapshot_game(game: TetrominoGame) -> tuple:
+    """Return the mutable state of game so that it can be brought back with restore_game.
+    The queue is not included since it is never mutated. To bring the game back only once,
+    save_game and undo_game are cheaper.
+    """
+    return (game.rows.copy(), game.heights.copy(), game.row_counts.copy(), game.holes,
+            game.board_hash, [row.copy() for row in game.board], game.queue_position,
+            game.current_combo, game.back_to_back, game.piece_position,
+            game.piece_orientation, game.hold, game.held, game.prev_held, game.held_index,
+            game.sent_garbage.copy(), game.total_attack, game.pending_garbage.copy(),
+            game.previous_action, game.game_over)
+
+
+def restore_game(game: TetrominoGame, snapshot: tuple) -> None:
+    """Bring game back to the state in a snapshot taken from it with snapshot_game. The same
+    snapshot can be restored more than once. Changes to the bitboard made by restoring are not
+    recorded for undo_game.
+    """
+    (rows, heights, row_counts, game.holes, game.board_hash, board, game.queue_position,
+     game.current_combo, game.back_to_back, game.piece_position, game.piece_orientation,
+     game.hold, game.held, game.prev_held, game.held_index, sent_garbage, game.total_attack,
+     pending_garbage, game.previous_action, game.game_over) = snapshot
+    game.rows = rows.copy()
+    game.heights = heights.copy()
+    game.row_counts = row_counts.copy()
+    game.board = [row.copy() for row in board]
+    game.sent_garbage = sent_garbage.copy()
+    game.pending_garbage = pending_garbage.copy()
+
+
+def pack_game(game: TetrominoGame, pieces: int) -> tuple:
+    """Return a compact copy of the state of game, with the bitboard packed into one
+    integer and only the next pieces pieces of the queue, for searching the game in another
+    process. unpack_game turns it back into a game without colours. The sent garbage and the
+    total attack are not kept.
+    """
+    # the queue is cut to start at the piece before the current one, which is the only
+    # earlier piece the held index is ever compared with
+    start = max(game.queue_position - 1, 0)
+    board = 0
+    for y in range(39, -1, -1):
+        board = board << 10 | game.rows[y]
+    return (board, game.queue[start:game.queue_position + pieces + 1],
+            game.queue_position - start, max(game.held_index - start, -1),
+            game.current_combo, game.back_to_back, tuple(game.piece_position),
+            game.piece_orientation, game.hold, game.held, game.prev_held,
+            tuple(game.pending_garbage), game.previous_action, game.game_over)
+
+
+def recount(game: TetrominoGame) -> None:
+    """Recalculate the heights, row_counts and holes of game from scratch using the bitboard"""
+    game.row_counts = [POPCOUNT[row] for row in game.rows]
+    game.heights = [-1] * 10
+    game.holes = 0
+    # columns with a filled cell somewhere above the current row
+    covered = 0
+    for y in range(39, -1, -1):
+        row = game.rows[y]
+        game.holes += POPCOUNT[covered & ~row]
+        for x in range(0, 10):
+            if (row & ~covered) >> x & 1:
+                game.heights[x] = y
+        covered |= row
+
+
+def state_hash(game: TetrominoGame) -> int:
+    """Return a 64-bit zobrist hash of the board of game, the current and held piece, whether the
+    piece was held, the queue position, the combo and back-to-back. Equal states have equal
+    hashes. Only the board part is kept up to date as the game changes, the rest is a few
+    keys folded in here.
+    """
+    value = game.board_hash ^ ZOBRIST_PIECES[game.get_piece(0)] ^ ZOBRIST_HELD[game.held] \
+        ^ _mix(ZOBRIST_QUEUE + game.queue_position) ^ _mix(ZOBRIST_COMBO + game.current_combo)
+    if game.hold:
+        value ^= ZOBRIST_HOLD
+    if game.back_to_back:
+        value ^= ZOBRIST_B2B
+    return value
+
+
+def save_game(game: TetrominoGame) -> None:
+    """Start recording the changes to game so that undo_game can bring it back to how it is
+    now. Only the fields that are not lists and the column heights are copied. The changes
+    to the bitboard are recorded as they are made: the rows covered by the piece locked by
+    lock_piece, the rows removed by _remove_rows and the rows pushed off the top by
+    _insert_garbage. The colour layer is copied if there is one.
+    """
+    game.history.append((game.heights.copy(), game.holes, game.board_hash, game.queue_position,
+                         game.current_combo, game.back_to_back, game.piece_position,
+                         game.piece_orientation, game.hold, game.held, game.prev_held,
+                         game.held_index, game.total_attack, tuple(game.pending_garbage),
+                         len(game.sent_garbage), game.previous_action, game.game_over,
+                         [row.copy() for row in game.board] if game.colours else None, []))
+
+
+def undo_game(game: TetrominoGame) -> None:
+    """Undo the changes to game since the last save_game, bringing back the board, cleared
+    rows, combo, back-to-back, hold, queue position and pending garbage exactly as they were.
+    The recorded changes to the bitboard are reversed in place, last first.
+
+    Preconditions:
+        - game.history != []
+    """
+    (heights, game.holes, game.board_hash, game.queue_position, game.current_combo,
+     game.back_to_back, game.piece_position, game.piece_orientation, game.hold, game.held,
+     game.prev_held, game.held_index, game.total_attack, pending_garbage, sent,
+     game.previous_action, game.game_over, board, changes) = game.history.pop()
+    rows = game.rows
+    row_counts = game.row_counts
+    for change in reversed(changes):
+        if change[0] == 'lock':
+            # put back the rows the piece covered
+            _, low, covered, counts = change
+            rows[low:low + len(covered)] = covered
+            row_counts[low:low + len(counts)] = counts
+        elif change[0] == 'clear':
+            # drop the empty rows added at the top and put the full rows back
+            tiled = change[1]
+            del rows[40 - len(tiled):]
+            del row_counts[40 - len(tiled):]
+            for i in tiled:
+                rows.insert(i, FULL_ROW)
+                row_counts.insert(i, 10)
+        else:
+            # drop the garbage rows and put back the rows pushed off the top
+            _, no_lines, top = change
+            del rows[:no_lines]
+            rows.extend(top)
+            del row_counts[:no_lines]
+            row_counts.extend([POPCOUNT[row] for row in top])
+    # the history owns the copies, so they are put back without copying them again
+    game.heights = heights
+    game.pending_garbage[:] = pending_garbage
+    del game.sent_garbage[sent:]
+    if board is not None:
+        game.board = board
+
+
+def random_since_save(game: TetrominoGame) -> bool:
+    """Return whether garbage, whose holes are random, was accepted by game since the earliest
+    save_game
+    that is not undone yet. If so, undoing and making the same moves again can lead to
+    another board.
+    """
+    return any(change[0] == 'garbage' for record in game.history for change in record[-1])
+
+
+def place_piece(game: TetrominoGame, inputs: List[str]) -> Tuple[int, List[int], int]:
+    """Make the inputs on game, then drop and lock the current piece. Return the result of
+    lock_piece. The placement is recorded with save_game so that undo_game can bring the game
+    back.
+    """
+    save_game(game)
+    game.do_inputs(inputs)
+    game.soft_drop()
+    return game.lock_piece()
+
+
+def place_piece_at(game: TetrominoGame, y: int, x: int, orientation: int,
+                   rotated: Optional[bool] = False,
+                   hold: Optional[bool] = False) -> Tuple[int, List[int], int]:
+    """Hold first if hold is True, then lock the current piece of game at the position [y, x]
+    and the orientation, as if the last input was a rotation if rotated. Return the result of
+    lock_piece. Unlike place_piece, no inputs are made, so the position should be one that
+    inputs can reach, like those found by the AI's placement search. The placement can be
+    undone with undo_game.
+
+    Raise ValueError, leaving the game unchanged, if the piece does not fit at the position
+    or would fall further from it.
+    """
+    save_game(game)
+    if hold:
+        game.hold_piece()
+    piece = game.get_piece(0)
+    if not fits(game.rows, piece, [y, x], orientation) \
+            or fits(game.rows, piece, [y - 1, x], orientation):
+        undo_game(game)
+        raise ValueError(f'the {piece} piece cannot lock at {[y, x]} in orientation '
+                         f'{orientation}')
+    game.change_board([y, x], orientation)
+    game.piece_position = [y, x]
+    game.piece_orientation = orientation
+    if rotated:
+        game.previous_action = 'rotate'
+    else:
+        game.previous_action = 'move'
+    return game.lock_piece()
+
+
+def unpack_game(packed: tuple) -> TetrominoGame:
+    """Return the game without colours packed by pack_game"""
+    game = TetrominoGame.__new__(TetrominoGame)
+    (board, queue, game.queue_position, game.held_index, game.current_combo, game.back_to_back,
+     piece_position, game.piece_orientation, game.hold, game.held, game.prev_held,
+     pending_garbage, game.previous_action, game.game_over) = packed
+    game.rows = [board >> 10 * y & FULL_ROW for y in range(0, 40)]
+    recount(game)
+    game.board_hash = board_hash(game.rows)
+    game.colours = False
+    game.board = []
+    game.queue = list(queue)
+    game.piece_position = list(piece_position)
+    game.sent_garbage = []
+    game.total_attack = 0
+    game.pending_garbage = list(pending_garbage)
+    game.history = []
+    return game
+
+
+def fits(rows: List[int], piece: str, position: List[int], orientation: int) -> bool:
+    """Return whether the piece can be at the position and orientation without leaving the
+    board or overlapping a filled cell of the bitboard rows. The current piece is not in the
+    bitboard so it never blocks itself.
+    """
+    y, x = position
+    min_y, max_y, min_x, max_x = PIECE_BOUNDS[piece][orientation]
+    if y < min_y or y > max_y or x < min_x or x > max_x:
+        return False
+    for dy, mask in PIECE_MASKS[piece][orientation][x]:
+        if rows[y + dy] & mask:
+            return False
+    return True
+
+
+def is_filled(rows: List[int], y: int, x: int) -> bool:
+    """Return whether the cell at [y, x] of the bitboard rows is filled"""
+    return rows[y] >> x & 1 == 1
+
+
+def landing_row(rows: List[int], heights: List[int], piece: str, position: List[int],
+                orientation: int) -> int:
+    """Return the row the piece would stop at if moved as far down as possible from the
+    position on the bitboard rows with the column heights. If the piece is above the stack in
+    every column it covers, the row is worked out from the heights. Otherwise the piece is
+    under an overhang and is stepped down.
+
+    Preconditions:
+        - fits(rows, piece, position, orientation)
+    """
+    y, x = position
+    landing = PIECE_BOUNDS[piece][orientation][0]
+    for dx, dy in PIECE_BOTTOMS[piece][orientation]:
+        resting = heights[x + dx] + 1 - dy
+        if resting > y:
+            while fits(rows, piece, [y - 1, x], orientation):
+                y -= 1
+            return y
+        landing = max(landing, resting)
+    return landing
+
+
+def t_spin_type(rows: List[int], position: List[int], orientation: int) -> str:
+    """Return 't', 'mini', or 'no' depending on the type of spin a t piece locked at the
+    position and orientation of the bitboard rows right after a rotation would be
+    """
+    y, x = position
+
+    # t-piece is at left wall
+    if x == 0:
+        if is_filled(rows, y - 1, x + 1) and is_filled(rows, y + 1, x + 1):
+            return 't'
+        elif is_filled(rows, y - 1, x + 1) or is_filled(rows, y + 1, x + 1):
+            return 'mini'
+        else:
+            return 'no'
+
+    # t-piece is at right wall
+    if x == 9:
+        if is_filled(rows, y - 1, x - 1) and is_filled(rows, y + 1, x - 1):
+            return 't'
+        elif is_filled(rows, y - 1, x - 1) or is_filled(rows, y + 1, x - 1):
+            return 'mini'
+        else:
+            return 'no'
+
+    # t-piece is flat at the bottom
+    if y == 0:
+        if is_filled(rows, y + 1, x + 1) or is_filled(rows, y + 1, x - 1):
+            return 'mini'
+        else:
+            return 'no'
+
+    # any other case
+    missing_corners = []
+    if not is_filled(rows, y + 1, x + 1):
+        missing_corners.append('tr')
+    if not is_filled(rows, y + 1, x - 1):
+        missing_corners.append('tl')
+    if not is_filled(rows, y - 1, x + 1):
+        missing_corners.append('br')
+    if not is_filled(rows, y - 1, x - 1):
+        missing_corners.append('bl')
+
+    # missing more than one corner means it is not a 't' or mini' kind of spin
+    if len(missing_corners) > 1:
+        return 'no'
+
+    # if the middle part of the T has a missing corner on either side, it is a 'mini'
+    if orientation == 0 and ('tr' in missing_corners or 'tl' in missing_corners):
+        return 'mini'
+    if orientation == 1 and ('tr' in missing_corners or 'br' in missing_corners):
+        return 'mini'
+    if orientation == 2 and ('bl' in missing_corners or 'br' in missing_corners):
+        return 'mini'
+    if orientation == 3 and ('bl' in missing_corners or 'tl' in missing_corners):
+        return 'mini'
+
+    # otherwise it is a t-spin
+    return 't'
 
 
 def get_filled(piece: str, position: List[int], orientation: int) -> Optional[List[List[int]]]:
@@ -1226,109 +973,11 @@ def get_filled(piece: str, position: List[int], orientation: int) -> Optional[Li
 
     Position is a list [y, x].
     """
-    if piece not in ('o', 'i'):
-        if orientation == 0 and (position[0] <= -1 or position[1] <= 0 or position[1] >= 9):
-            return None
-        if orientation == 1 and (position[0] <= 0 or position[1] <= -1 or position[1] >= 9):
-            return None
-        if orientation == 2 and (position[0] <= 0 or position[1] <= 0 or position[1] >= 9):
-            return None
-        if orientation == 3 and (position[0] <= 0 or position[1] <= 0 or position[1] >= 10):
-            return None
-    if piece == 'l':
-        if orientation == 0:
-            return [[position[0], position[1] - 1], [position[0], position[1]],
-                    [position[0], position[1] + 1], [position[0] + 1, position[1] + 1]]
-        if orientation == 1:
-            return [[position[0] + 1, position[1]], [position[0], position[1]],
-                    [position[0] - 1, position[1]], [position[0] - 1, position[1] + 1]]
-        if orientation == 2:
-            return [[position[0] - 1, position[1] - 1], [position[0], position[1] - 1],
-                    [position[0], position[1]], [position[0], position[1] + 1]]
-        if orientation == 3:
-            return [[position[0] + 1, position[1] - 1], [position[0] + 1, position[1]],
-                    [position[0], position[1]], [position[0] - 1, position[1]]]
-    if piece == 'j':
-        if orientation == 0:
-            return [[position[0], position[1] - 1], [position[0], position[1]],
-                    [position[0], position[1] + 1], [position[0] + 1, position[1] - 1]]
-        if orientation == 1:
-            return [[position[0] + 1, position[1]], [position[0], position[1]],
-                    [position[0] - 1, position[1]], [position[0] + 1, position[1] + 1]]
-        if orientation == 2:
-            return [[position[0] - 1, position[1] + 1], [position[0], position[1] - 1],
-                    [position[0], position[1]], [position[0], position[1] + 1]]
-        if orientation == 3:
-            return [[position[0] - 1, position[1] - 1], [position[0] + 1, position[1]],
-                    [position[0], position[1]], [position[0] - 1, position[1]]]
-    if piece == 't':
-        if orientation == 0:
-            return [[position[0], position[1] - 1], [position[0], position[1]],
-                    [position[0], position[1] + 1], [position[0] + 1, position[1]]]
-        if orientation == 1:
-            return [[position[0] + 1, position[1]], [position[0], position[1]],
-                    [position[0] - 1, position[1]], [position[0], position[1] + 1]]
-        if orientation == 2:
-            return [[position[0], position[1] - 1], [position[0], position[1]],
-                    [position[0], position[1] + 1], [position[0] - 1, position[1]]]
-        if orientation == 3:
-            return [[position[0] - 1, position[1]], [position[0], position[1]],
-                    [position[0] + 1, position[1]], [position[0], position[1] - 1]]
-    if piece == 's':
-        if orientation == 0:
-            return [[position[0], position[1] - 1], [position[0], position[1]],
-                    [position[0] + 1, position[1]], [position[0] + 1, position[1] + 1]]
-        if orientation == 1:
-            return [[position[0] + 1, position[1]], [position[0], position[1] + 1],
-                    [position[0], position[1]], [position[0] - 1, position[1] + 1]]
-        if orientation == 2:
-            return [[position[0], position[1] + 1], [position[0], position[1]],
-                    [position[0] - 1, position[1]], [position[0] - 1, position[1] - 1]]
-        if orientation == 3:
-            return [[position[0] + 1, position[1] - 1], [position[0], position[1] - 1],
-                    [position[0], position[1]], [position[0] - 1, position[1]]]
-    if piece == 'z':
-        if orientation == 0:
-            return [[position[0] + 1, position[1] - 1], [position[0] + 1, position[1]],
-                    [position[0], position[1]], [position[0], position[1] + 1]]
-        if orientation == 1:
-            return [[position[0] + 1, position[1] + 1], [position[0], position[1] + 1],
-                    [position[0], position[1]], [position[0] - 1, position[1]]]
-        if orientation == 2:
-            return [[position[0], position[1] - 1], [position[0] - 1, position[1]],
-                    [position[0], position[1]], [position[0] - 1, position[1] + 1]]
-        if orientation == 3:
-            return [[position[0] + 1, position[1]], [position[0], position[1] - 1],
-                    [position[0], position[1]], [position[0] - 1, position[1] - 1]]
-    if piece == 'o':
-        if position[1] >= 9 or position[1] <= -1:
-            return None
-        if position[0] <= -1:
-            return None
-        return [[position[0], position[1] + 1], [position[0] + 1, position[1]],
-                [position[0], position[1]], [position[0] + 1, position[1] + 1]]
-    if piece == 'i':
-        if orientation == 0 and (position[1] <= 0 or position[1] >= 8 or position[0] <= -1):
-            return None
-        if orientation == 2 and (position[1] <= 1 or position[1] >= 9 or position[0] <= -1):
-            return None
-        if orientation == 1 and (position[1] <= -1 or position[1] >= 10 or position[0] <= 1):
-            return None
-        if orientation == 3 and (position[1] <= -1 or position[1] >= 10 or position[0] <= 0):
-            return None
-        if orientation == 0:
-            return [[position[0], position[1] - 1], [position[0], position[1]],
-                    [position[0], position[1] + 1], [position[0], position[1] + 2]]
-        if orientation == 1:
-            return [[position[0] + 1, position[1]], [position[0], position[1]],
-                    [position[0] - 1, position[1]], [position[0] - 2, position[1]]]
-        if orientation == 2:
-            return [[position[0], position[1] - 2], [position[0], position[1] - 1],
-                    [position[0], position[1]], [position[0], position[1] + 1]]
-        if orientation == 3:
-            return [[position[0] + 2, position[1]], [position[0] + 1, position[1]],
-                    [position[0], position[1]], [position[0] - 1, position[1]]]
-    return None
+    y, x = position
+    min_y, max_y, min_x, max_x = PIECE_BOUNDS[piece][orientation]
+    if y < min_y or y > max_y or x < min_x or x > max_x:
+        return None
+    return [[y + dy, x + dx] for dy, dx in PIECE_CELLS[piece][orientation]]
 
 
 if __name__ == '__main__':
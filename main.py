@@ -4,13 +4,16 @@ CSC111 Final Project
 This is the main file and will generate queues and run AI vs AI games
 """
 from random import shuffle, random, choice
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from time import sleep
 import csv
+import os
 from visualization import Visualizer
 from game import TetrominoGame
 from eval import TetrominoAI
+from features import placement_features, population_agreement
 from graph import format_csv, generate_graph
+from profiler import Profiler, merge_profiles
 
 SIZE = 20  # number of members in the population
 
@@ -34,8 +37,12 @@ def generate_queue(length: int) -> List[str]:
     return queue
 
 
-def test(weight1: List[float], weight2: List[float]) -> Tuple[int, float, float]:
-    """Display a battle between AIs using two weights
+def test(weight1: List[float], weight2: List[float], profile: Optional[str] = None,
+         profile_mode: str = 'cprofile', ponder: int = 0) -> Tuple[int, float, float]:
+    """Display a battle between AIs using two weights. If profile is given, the battle is
+    profiled with profile_mode, see Profiler, and written to profile + '.pstats' for
+    'cprofile' or profile + '.collapsed' for 'sample'. ponder is the number of levels each AI
+    may search deeper between its moves, see TetrominoAI.
 
     Preconditions:
     - len(weight1) == 12
@@ -47,25 +54,21 @@ def test(weight1: List[float], weight2: List[float]) -> Tuple[int, float, float]
     queue = generate_queue(10000)
     g1 = TetrominoGame(queue)
     g2 = TetrominoGame(queue)
-    a1 = TetrominoAI(g1, 2, 2, weight1)
-    a2 = TetrominoAI(g2, 2, 2, weight2)
+    a1 = TetrominoAI(g1, 2, 2, weight1, ponder=ponder)
+    a2 = TetrominoAI(g2, 2, 2, weight2, ponder=ponder)
     v = Visualizer((700, 700), g1, g2)
     sleep(1)
-    # play the game until one loses
-    while g1.game_over is not True and g2.game_over is not True:
-        v.wake()  # make sure the visualization does not freeze
-        a1.generate_tree()
-        a2.generate_tree()
-        a1.make_move()
-        a2.make_move()
-        g1.pending_garbage.extend(g2.sent_garbage)
-        g2.pending_garbage.extend(g1.sent_garbage)
-        g1.sent_garbage.clear()
-        g2.sent_garbage.clear()
-        v.update_board(1, g1)
-        v.update_board(2, g2)
-        # add a delay
-        # sleep(0.3)
+    # play the game until one loses, stopping the profiler and the processes of the AIs even
+    # if the match fails
+    try:
+        if profile is None:
+            play(a1, a2, v)
+        else:
+            with Profiler(profile, profile_mode):
+                play(a1, a2, v)
+    finally:
+        a1.close()
+        a2.close()
     v.update_board(1, g1)
     v.update_board(2, g2)
     app1 = g1.get_app()
@@ -81,6 +84,28 @@ def test(weight1: List[float], weight2: List[float]) -> Tuple[int, float, float]
         return (1, app1, app2)
 
 
+def play(a1: TetrominoAI, a2: TetrominoAI, v: Visualizer) -> None:
+    """Play the games of a1 and a2 against each other on v until one loses. Each AI moves
+    right after searching, so that it ponders while the other one searches.
+    """
+    g1 = a1.game
+    g2 = a2.game
+    while g1.game_over is not True and g2.game_over is not True:
+        v.wake()  # make sure the visualization does not freeze
+        a1.generate_tree()
+        a1.make_move()
+        a2.generate_tree()
+        a2.make_move()
+        g1.pending_garbage.extend(g2.sent_garbage)
+        g2.pending_garbage.extend(g1.sent_garbage)
+        g1.sent_garbage.clear()
+        g2.sent_garbage.clear()
+        v.update_board(1, g1)
+        v.update_board(2, g2)
+        # add a delay
+        # sleep(0.3)
+
+
 def initiate(size: int = SIZE) -> List[List[float]]:
     """Make an initial population using random weights
 
@@ -92,9 +117,53 @@ def initiate(size: int = SIZE) -> List[List[float]]:
     return p
 
 
-def compare(population: List[List[float]]) -> List[List[float]]:
+def record_positions(weights: List[float], moves: int) -> List[Tuple[List[List[int]], int]]:
+    """Play a game with weights without displaying it and return each position reached in up
+    to moves moves, as the linear features of every placement from it and the index of the
+    placement the AI chose.
+
+    Preconditions:
+    - len(weights) == 12
+    - moves >= 1
+    """
+    g = TetrominoGame(generate_queue(10000), colours=False)
+    a = TetrominoAI(g, 2, 2, weights)
+    positions = []
+    while len(positions) < moves and g.game_over is not True:
+        a.generate_tree()
+        # the placement make_move will choose
+        best = max(a.tree.subtrees, key=lambda s: s.sub_score)
+        placements, features = placement_features(a.tree.game_state)
+        positions.append((features, placements.index(best.inputs)))
+        a.make_move()
+    a.close()
+    return positions
+
+
+def prescreen(population: List[List[float]], positions: List[Tuple[List[List[int]], int]],
+              size: int) -> List[List[float]]:
+    """Return the size members of the population that most often agree with the placements
+    chosen at positions from record_positions. The whole population is scored on every position
+    at once, which is much cheaper than compare and can narrow a population before it.
+    Members are kept in their order, and ties go to the earlier member. Needs numpy, raising
+    ImportError without it.
+
+    Preconditions:
+    - positions != []
+    - 1 <= size <= len(population)
+    """
+    agreement = population_agreement(population, positions)
+    ranked = sorted(range(0, len(population)), key=lambda i: -agreement[i])
+    return [population[i] for i in sorted(ranked[:size])]
+
+
+def compare(population: List[List[float]], profile: Optional[str] = None,
+            profile_mode: str = 'cprofile') -> List[List[float]]:
     """Determine the best members of the population using win/loss count.
     Ties are broken with attack per piece.
+
+    If profile is given, each pairing i, j is profiled with profile_mode to
+    profile + '-pair<i>-<j>' like test, and all of them are added together in profile.
     """
     # match each member of the population which every other member
     pairings = []
@@ -107,7 +176,11 @@ def compare(population: List[List[float]]) -> List[List[float]]:
     # test the pair against each other and determine the winner in a 1v1
     for pair in pairings:
         # print(pair)
-        results = test(population[pair[0]], population[pair[1]])
+        if profile is None:
+            results = test(population[pair[0]], population[pair[1]])
+        else:
+            results = test(population[pair[0]], population[pair[1]],
+                           f'{profile}-pair{pair[0]}-{pair[1]}', profile_mode)
         if results[0] == 1:
             scores[pair[0]] += 1
         else:
@@ -115,6 +188,9 @@ def compare(population: List[List[float]]) -> List[List[float]]:
         app[pair[0]].append(results[1])
         app[pair[1]].append(results[2])
 
+    if profile is not None:
+        merge_profiles([f'{profile}-pair{i}-{j}' for i, j in pairings], profile, profile_mode)
+
     # average the APP for each player
     for i in range(0, len(app)):
         app[i] = sum(app[i]) / len(app[i])
@@ -134,15 +210,24 @@ def compare(population: List[List[float]]) -> List[List[float]]:
     return best
 
 
-def refill(parents: List[List[float]], size: int = SIZE) -> List[List[float]]:
+def refill(parents: List[List[float]], size: int = SIZE,
+           positions: Optional[List[Tuple[List[List[int]], int]]] = None) -> List[List[float]]:
     """Refill the population to size by making
     children with the original population as parents
 
+    If positions from record_positions are given, twice as many children are made and only
+    the half that prescreen ranks best on them are kept. Needs numpy.
+
     Preconditions:
     - size >= 2"""
+    needed = size - len(parents)
+    if positions is not None and needed > 0:
+        needed *= 2
     children = []
-    while len(parents) + len(children) < size:
+    while len(children) < needed:
         children.append(cross(choice(parents), choice(parents)))
+    if positions is not None and children != []:
+        children = prescreen(children, positions, size - len(parents))
     children.extend(parents)
     return children
 
@@ -173,10 +258,18 @@ def write_csv(weights: List[List[float]]) -> None:
     writer.writerows(original + weights)
 
 
-def run(size: int = SIZE) -> None:
+def run(size: int = SIZE, profile: Optional[str] = None, screen: int = 0,
+        profile_mode: str = 'cprofile') -> None:
     """Create an initial population if none available and test members of the population against
     one another to try and select for traits that provide the best chance to win in a 1v1 game.
 
+    If profile is given, the generation is profiled with profile_mode like compare into the
+    directory profile, labelled gen<g> where g is the number of generations already in
+    weights.csv.
+
+    If screen is above 0, the children of the next generation are prescreened on screen
+    positions played by the best member before being kept, see refill. Needs numpy.
+
     Preconditions:
     - size >= 2"""
     # read weights.csv for previous weights
@@ -189,8 +282,16 @@ def run(size: int = SIZE) -> None:
         population = [prev_weights[len(prev_weights) - i - 1]
                       for i in range(0, size)]
     # compare the weights in the population
-    best = compare(population)
-    population = refill(best)
+    if profile is None:
+        best = compare(population)
+    else:
+        os.makedirs(profile, exist_ok=True)
+        best = compare(population, os.path.join(profile, f'gen{len(prev_weights) // size}'),
+                       profile_mode)
+    if screen > 0:
+        population = refill(best, size, record_positions(best[0], screen))
+    else:
+        population = refill(best, size)
 
     # write the next generation to the weights.csv
     write_csv(population)
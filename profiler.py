@@ -0,0 +1,165 @@
+"""
+Profile matches and generations.
+
+Used to find where the time of a match or a generation goes. Each profile is written either
+as a pstats file by cProfile or as collapsed stacks, sampled from the running thread, that
+flamegraph tools can draw. Only one of the two runs at a time, so neither skews the other.
+"""
+import cProfile
+import os
+import pstats
+import sys
+from threading import Thread, get_ident
+from time import sleep
+from typing import Dict, List, Optional
+
+
+class Profiler:
+    """Profiles the thread that starts it, with cProfile in mode 'cprofile' or by sampling its
+    stack from another thread in mode 'sample'. stop writes the cProfile statistics to
+    path + '.pstats', or the sampled stacks to path + '.collapsed', one line of the frames from
+    the outermost to the innermost separated by semicolons and the number of samples of that
+    stack.
+
+    Instance Attributes:
+        - path: the path of the file written, without its extension
+        - mode: the profiler used, 'cprofile' or 'sample'
+        - interval: the seconds between samples of the stack
+        - profile: the deterministic profiler of the thread
+        - samples: the number of samples of each collapsed stack
+        - target: the id of the thread profiled, None if not started
+        - thread: the thread sampling the stack, None if not started
+        - running: whether the stack is still being sampled
+
+    Representation Invariants:
+        - self.mode in {'cprofile', 'sample'}
+        - self.interval > 0
+        - all(count >= 1 for count in self.samples.values())
+    """
+    path: str
+    mode: str
+    interval: float
+    profile: cProfile.Profile
+    samples: Dict[str, int]
+    target: Optional[int]
+    thread: Optional[Thread]
+    running: bool
+
+    def __init__(self, path: str, mode: Optional[str] = 'cprofile',
+                 interval: Optional[float] = 0.001) -> None:
+        """Initialize a Profiler writing to path with mode, sampling every interval seconds
+
+        Preconditions:
+            - mode in {'cprofile', 'sample'}
+        """
+        self.path = path
+        self.mode = mode
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        self.samples = {}
+        self.target = None
+        self.thread = None
+        self.running = False
+
+    def __enter__(self) -> 'Profiler':
+        """Start profiling at the start of a with block"""
+        self.start()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        """Stop profiling and write the files at the end of a with block"""
+        self.stop()
+
+    def start(self) -> None:
+        """Start profiling the current thread"""
+        if self.mode == 'cprofile':
+            self.profile.enable()
+        else:
+            self.target = get_ident()
+            self.running = True
+            self.thread = Thread(target=self.sample, daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Stop profiling and write the file"""
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            self.profile.dump_stats(self.path + '.pstats')
+        else:
+            self.running = False
+            self.thread.join()
+            write_collapsed(self.samples, self.path + '.collapsed')
+
+    def sample(self) -> None:
+        """Sample the stack of the profiled thread until stopped. Samples taken while the
+        thread is running the profiler itself, in start or stop, are dropped.
+        """
+        while self.running:
+            sleep(self.interval)
+            frame = sys._current_frames().get(self.target)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                if code.co_filename == __file__:
+                    frames = []
+                    break
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:'
+                              f'{code.co_firstlineno})')
+                frame = frame.f_back
+            if frames != []:
+                stack = ';'.join(reversed(frames))
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+
+
+def write_collapsed(samples: Dict[str, int], path: str) -> None:
+    """Write the samples of each collapsed stack to path"""
+    with open(path, 'w') as file:
+        for stack, count in sorted(samples.items()):
+            file.write(f'{stack} {count}\n')
+
+
+def read_collapsed(path: str) -> Dict[str, int]:
+    """Return the samples of each collapsed stack written to path"""
+    samples = {}
+    with open(path, 'r') as file:
+        for line in file:
+            stack, count = line.rstrip('\n').rsplit(' ', 1)
+            samples[stack] = samples.get(stack, 0) + int(count)
+    return samples
+
+
+def merge_profiles(paths: List[str], path: str, mode: Optional[str] = 'cprofile') -> None:
+    """Add together the profiles written to each of paths by a Profiler with mode and write
+    them to path like a Profiler would
+
+    Preconditions:
+    - paths != []
+    - mode in {'cprofile', 'sample'}
+    """
+    if mode == 'cprofile':
+        stats = pstats.Stats(paths[0] + '.pstats')
+        for other in paths[1:]:
+            stats.add(other + '.pstats')
+        stats.dump_stats(path + '.pstats')
+    else:
+        samples = {}
+        for other in paths:
+            for stack, count in read_collapsed(other + '.collapsed').items():
+                samples[stack] = samples.get(stack, 0) + count
+        write_collapsed(samples, path + '.collapsed')
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['cProfile', 'os', 'pstats', 'sys', 'threading', 'time'],
+        'allowed-io': ['write_collapsed', 'read_collapsed'],
+        'max-line-length': 100,
+        'disable': ['W0212']
+    })
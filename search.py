@@ -0,0 +1,449 @@
+"""
+The search infrastructure of the AI: the settings, budget, statistics, table and cache a
+search shares, the search for the placements of a piece, and the functions that search in the
+processes of a pool.
+"""
+from __future__ import annotations
+from typing import List, Optional, Tuple, TYPE_CHECKING
+from collections import deque, OrderedDict
+from concurrent.futures import Executor
+from multiprocessing import synchronize
+from time import perf_counter
+from game import TetrominoGame, KICKS, PIECE_CELLS, fits, landing_row, pack_game, \
+    restore_game, save_game, t_spin_type, undo_game, unpack_game
+
+if TYPE_CHECKING:
+    from eval import GameTree
+
+# the event that stops the pondering of this process, kept by set_ponder_signal
+PONDER_SIGNAL = {}
+
+
+class SearchContext:
+    """What every tree of one search shares: how deep and how wide it searches, the weights it
+    scores with, and the table, cache and statistics it uses
+
+    Instance Attributes:
+        - max_height: limits the maximum height of the tree
+        - best_n: limits the number of subtrees to recurse on to the best n subtrees
+        - weights: the weights for the heuristics used to evaluate the piece placements
+        - table: the scores of states already searched. None to search every state
+        - cache: the features of boards already evaluated. None to evaluate every board
+        - stats: the statistics the search is added to, None to not keep any
+        - batch: whether the placements from each tree are scored all at once with numpy
+        instead of one at a time. Only used if numpy is installed
+
+    Representation Invariants:
+        - self.max_height >= 2
+        - self.best_n >= 1
+    """
+    __slots__ = ('max_height', 'best_n', 'weights', 'table', 'cache', 'stats', 'batch')
+    max_height: int
+    best_n: int
+    weights: List[float]
+    table: Optional[TranspositionTable]
+    cache: Optional[EvaluationCache]
+    stats: Optional[SearchStats]
+    batch: bool
+
+    def __init__(self, max_height: int, best_n: int, weights: List[float],
+                 table: Optional[TranspositionTable] = None,
+                 cache: Optional[EvaluationCache] = None,
+                 stats: Optional[SearchStats] = None, batch: Optional[bool] = False) -> None:
+        """Initialize a new SearchContext"""
+        self.max_height = max_height
+        self.best_n = best_n
+        self.weights = weights
+        self.table = table
+        self.cache = cache
+        self.stats = stats
+        self.batch = batch
+
+
+class SearchBudget:
+    """The time and the number of evaluated placements one search may still use
+
+    Instance Attributes:
+        - deadline: the time.perf_counter() time the search must stop by, None for no limit
+        - nodes: the number of placements the search may still evaluate, None for no limit
+        - stopped: whether the search was told to stop
+        - signal: an event that stops the search once set, which may be done from another
+        process. None if there is none
+    """
+    deadline: Optional[float]
+    nodes: Optional[int]
+    stopped: bool
+    signal: Optional[synchronize.Event]
+
+    def __init__(self, seconds: Optional[float] = None, nodes: Optional[int] = None,
+                 signal: Optional[synchronize.Event] = None) -> None:
+        """Initialize a SearchBudget of seconds from now and nodes evaluated placements"""
+        if seconds is None:
+            self.deadline = None
+        else:
+            self.deadline = perf_counter() + seconds
+        self.nodes = nodes
+        self.stopped = False
+        self.signal = signal
+
+    def stop(self) -> None:
+        """Tell the search to stop, which may be done from another thread"""
+        self.stopped = True
+
+    def spent(self) -> bool:
+        """Return whether the search has run out of time or placements or was stopped"""
+        return self.stopped or (self.signal is not None and self.signal.is_set()) \
+            or (self.deadline is not None and perf_counter() >= self.deadline) \
+            or (self.nodes is not None and self.nodes <= 0)
+
+
+class SearchStats:
+    """Statistics of the search of one or more moves. Every tree searching a move shares one
+    SearchStats and adds to it as it goes. The searches done in the background by ponder are
+    not counted, and of the work done in other processes by workers only the placements they
+    generate are. Timing is only measured when statistics are kept.
+
+    Instance Attributes:
+        - moves: the number of moves searched
+        - generated: the number of placements generated
+        - evaluated: the number of placements scored without finding them in the table
+        - pruned: the number of placements generated in the search that prune or the beam
+        did not keep
+        - depth: the most levels below the root any placement was generated at
+        - simulation: the seconds spent generating placements and placing them
+        - evaluation: the seconds spent scoring placements, apart from placing them
+        - selection: the seconds spent choosing which placements to keep
+        - total: the seconds spent searching
+
+    Representation Invariants:
+        - self.moves >= 0
+        - self.generated >= 0 and self.evaluated >= 0 and self.pruned >= 0
+        - self.depth >= 0
+    """
+    moves: int
+    generated: int
+    evaluated: int
+    pruned: int
+    depth: int
+    simulation: float
+    evaluation: float
+    selection: float
+    total: float
+
+    def __init__(self) -> None:
+        """Initialize a SearchStats of no search"""
+        self.moves = 0
+        self.generated = 0
+        self.evaluated = 0
+        self.pruned = 0
+        self.depth = 0
+        self.simulation = 0.0
+        self.evaluation = 0.0
+        self.selection = 0.0
+        self.total = 0.0
+
+    def add(self, other: SearchStats) -> None:
+        """Add the statistics of other to these, keeping the deeper depth"""
+        self.moves += other.moves
+        self.generated += other.generated
+        self.evaluated += other.evaluated
+        self.pruned += other.pruned
+        self.depth = max(self.depth, other.depth)
+        self.simulation += other.simulation
+        self.evaluation += other.evaluation
+        self.selection += other.selection
+        self.total += other.total
+
+    def nodes_per_second(self) -> float:
+        """Return the placements generated per second of search, 0 if there was none"""
+        if self.total == 0:
+            return 0.0
+        return self.generated / self.total
+
+    def record(self) -> dict:
+        """Return the statistics as a dict, which can be written out as JSON or CSV"""
+        return {'moves': self.moves, 'generated': self.generated, 'evaluated': self.evaluated,
+                'pruned': self.pruned, 'depth': self.depth, 'simulation': self.simulation,
+                'evaluation': self.evaluation, 'selection': self.selection,
+                'total': self.total, 'nodes_per_second': self.nodes_per_second()}
+
+
+class EvaluationCache:
+    """A cache of the features of boards right after a placement, so that a board reached
+    again from another parent or with another hold choice is not evaluated again. The
+    features do not depend on the weights. Once full, the least recently used board is
+    forgotten.
+
+    Each key is the board hash after a placement with the attack, the kind of clear and the
+    combo of the placement.
+
+    Instance Attributes:
+        - capacity: the most entries kept in the cache
+        - entries: maps each key to the features from get_features. Ordered from least to most
+        recently used
+        - hits: the number of lookups that found features
+        - misses: the number of lookups that did not
+
+    Representation Invariants:
+        - self.capacity >= 1
+        - len(self.entries) <= self.capacity
+        - self.hits >= 0 and self.misses >= 0
+    """
+    capacity: int
+    entries: OrderedDict
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int) -> None:
+        """Initialize an empty EvaluationCache"""
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[List[int]]:
+        """Return the features of key, or None if they are not in the cache"""
+        features = self.entries.get(key)
+        if features is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return features
+
+    def store(self, key: tuple, features: List[int]) -> None:
+        """Store the features of key"""
+        self.entries[key] = features
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        """Return the fraction of lookups that found features, 0 if there were none"""
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits / (self.hits + self.misses)
+
+
+class TranspositionTable:
+    """A table of the scores of game states already searched, so that a state reached again
+    by other inputs or through a different order of placements is not searched again. Once
+    full, the least recently used state is forgotten.
+
+    Each key is the state hash of the game after a placement with the attack, the kind of
+    clear and the pending garbage of the placement, since the raw score depends on those too.
+
+    Instance Attributes:
+        - capacity: the most entries kept in the table
+        - entries: maps each key to [raw_score, sub_score, depth] where depth is the number of
+        levels searched below the state to get sub_score. Ordered from least to most recently
+        used
+
+    Representation Invariants:
+        - self.capacity >= 1
+        - len(self.entries) <= self.capacity
+    """
+    capacity: int
+    entries: OrderedDict
+
+    def __init__(self, capacity: int) -> None:
+        """Initialize an empty TranspositionTable"""
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[list]:
+        """Return the [raw_score, sub_score, depth] entry of key, or None if there is none"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key: tuple, raw_score: float, sub_score: float, depth: int) -> None:
+        """Store the scores of key, unless key has a score from a deeper search already"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = [raw_score, sub_score, depth]
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+            if depth >= entry[2]:
+                entry[1] = sub_score
+                entry[2] = depth
+
+
+def set_ponder_signal(signal: synchronize.Event) -> None:
+    """Keep signal as the event that stops the pondering of this process. Run by each process
+    of a pool that ponders.
+    """
+    PONDER_SIGNAL['signal'] = signal
+
+
+def expand_pool(game: TetrominoGame, trees: List[Tuple[GameTree, tuple]],
+                search: SearchContext, pool: Executor, chunks: int) -> None:
+    """Expand each tree without subtrees of search in the processes of pool, split into chunks.
+    Each tree is given with the snapshot of game at it. game is left at an unspecified snapshot.
+    """
+    trees = [(tree, snapshot) for tree, snapshot in trees if tree.subtrees == []]
+    if trees == []:
+        return
+    packed = []
+    for tree, snapshot in trees:
+        restore_game(game, snapshot)
+        # the current piece and two more in case it is held
+        packed.append((tree, pack_game(game, 2)))
+    size = -(-len(packed) // chunks)
+    results = pool.map(expand_packed, [packed[i:i + size] for i in range(0, len(packed), size)],
+                       [SearchContext(2, 1, search.weights, batch=search.batch)] * chunks)
+    i = 0
+    for chunk in results:
+        for placements in chunk:
+            trees[i][0].add_subtrees(placements, search)
+            i += 1
+
+
+def expand_packed(trees: List[Tuple[GameTree, tuple]], search: SearchContext) -> \
+        List[List[Tuple[Tuple[str, ...], float]]]:
+    """Return the (inputs, raw_score) of every placement from each tree without subtrees,
+    given with its game packed with pack_game, expanding a copy of the tree with search. Used to
+    expand trees in another process.
+    """
+    placements = []
+    for tree, packed in trees:
+        tree.expand(unpack_game(packed), search)
+        placements.append([(s.inputs, s.raw_score) for s in tree.subtrees])
+    return placements
+
+
+def search_packed(tree: GameTree, packed: tuple) -> float:
+    """Return the sub_score of tree, a root with its own search but without a game, searched
+    from its game packed with pack_game. Used to search a subtree in another process.
+    """
+    tree.game_state = unpack_game(packed)
+    tree.generate_subtrees()
+    tree.get_sub_score()
+    return tree.sub_score
+
+
+def ponder_packed(tree: GameTree, packed: tuple, lowest: int,
+                  limit: int) -> Tuple[int, List[GameTree]]:
+    """Search tree, a root with its own search and the subtrees it was searched with so far but
+    without a game, from its game packed with pack_game one level deeper at a time from lowest
+    to limit until the pondering of this process is stopped. Return the deepest height searched
+    in full, or lowest - 1 if none was, with the subtrees of the root, which keep any deeper
+    subtrees an unfinished height generated. Used to ponder in another process, see
+    set_ponder_signal.
+    """
+    tree.game_state = unpack_game(packed)
+    budget = SearchBudget(signal=PONDER_SIGNAL['signal'])
+    height = lowest
+    while height <= limit:
+        tree.search.max_height = height
+        tree.generate_subtrees(budget=budget)
+        if budget.spent():
+            break
+        height += 1
+    return (height - 1, tree.subtrees)
+
+
+def get_placements(game: TetrominoGame) -> List[Tuple[str, ...]]:
+    """Return the shortest inputs for every distinct placement of the current piece, followed
+    by those of the piece swapped in by holding if holding is allowed. game is left unchanged.
+    """
+    return [inputs for inputs, _ in find_placements(game)]
+
+
+def find_placements(game: TetrominoGame) -> \
+        List[Tuple[Tuple[str, ...], Tuple[int, int, int, bool]]]:
+    """Return the inputs of every placement like get_placements, each with where it locks like
+    GameTree.placed. game is left unchanged.
+    """
+    placements = search_placements(game, ())
+    if game.hold is False:
+        save_game(game)
+        game.hold_piece()
+        placements.extend(search_placements(game, ('hold',)))
+        undo_game(game)
+    return placements
+
+
+def search_placements(game: TetrominoGame, prefix: Tuple[str, ...]) -> \
+        List[Tuple[Tuple[str, ...], Tuple[int, int, int, bool]]]:
+    """Return the shortest inputs, each starting with prefix, for every distinct placement the
+    current piece can reach from where it is, with where it locks like GameTree.placed.
+    Placements are found with a breadth-first search over the positions reachable with left,
+    right, cw, ccw and drop (a soft drop) inputs using the real kick tables, so tucks and spins
+    are included. Placements with the same final cells are only returned once, except that a
+    t-spin is kept apart from the same cells locked without a spin.
+    """
+    piece = game.get_piece(0)
+    start = (game.piece_position[0], game.piece_position[1], game.piece_orientation, False)
+    if not fits(game.rows, piece, [start[0], start[1]], start[2]):
+        return []
+
+    # each state is the position, orientation and whether the last input was a t rotation,
+    # and is mapped to the state and input it was first reached from
+    parents = {start: None}
+    to_visit = deque([start])
+    # the final positions already seen, and the first state found for each set of final cells
+    finals = set()
+    placements = {}
+    while to_visit:
+        state = to_visit.popleft()
+        y, x, orientation, rotated = state
+        landing = landing_row(game.rows, game.heights, piece, [y, x], orientation)
+        spin = rotated and landing == y and t_spin_type(game.rows, [y, x], orientation) != 'no'
+        if (landing, x, orientation, spin) not in finals:
+            finals.add((landing, x, orientation, spin))
+            cells = frozenset((landing + dy, x + dx) for dy, dx in PIECE_CELLS[piece][orientation])
+            if (cells, spin) not in placements:
+                placements[(cells, spin)] = (state, landing)
+
+        new_states = []
+        if fits(game.rows, piece, [y, x - 1], orientation):
+            new_states.append(((y, x - 1, orientation, False), 'left'))
+        if fits(game.rows, piece, [y, x + 1], orientation):
+            new_states.append(((y, x + 1, orientation, False), 'right'))
+        for move, new_orientation in (('cw', (orientation + 1) % 4),
+                                      ('ccw', (orientation + 3) % 4)):
+            for dy, dx in KICKS[piece].get((orientation, new_orientation), ()):
+                if fits(game.rows, piece, [y + dy, x + dx], new_orientation):
+                    new_states.append(((y + dy, x + dx, new_orientation, piece == 't'), move))
+                    break
+        if landing != y:
+            new_states.append(((landing, x, orientation, False), 'drop'))
+
+        for new_state, move in new_states:
+            if new_state not in parents:
+                parents[new_state] = (state, move)
+                to_visit.append(new_state)
+
+    # follow the parents back to the start to get the inputs of each placement
+    all_inputs = []
+    for state, landing in placements.values():
+        # the piece locks right after a rotation of any piece if it is not dropped after it
+        placed = (landing, state[1], state[2],
+                  landing == state[0] and parents[state] is not None
+                  and parents[state][1] in ('cw', 'ccw'))
+        inputs = []
+        while parents[state] is not None:
+            state, move = parents[state]
+            inputs.append(move)
+        all_inputs.append((prefix + tuple(reversed(inputs)), placed))
+    return all_inputs
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['collections', 'concurrent.futures', 'multiprocessing', 'time',
+                          'game', 'eval'],  # the names (strs) of imported modules
+        'allowed-io': [],  # the names (strs) of functions that call print/open/input
+        'max-line-length': 100,
+        'disable': ['E1136', 'R0902', 'R0913'],
+    })